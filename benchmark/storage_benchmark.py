@@ -0,0 +1,393 @@
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+import yaml
+
+FORMATS = ('csv', 'excel', 'parquet', 'json', 'yaml', 'raw')
+BACKENDS = ('local', 's3', 'az', 'gcp')
+
+AZURITE_CONNECTION_STRING = ('DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;'
+                             'AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/'
+                             'K1SZFPTOtr/KBHBeksoGMGw==;BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;')
+
+DEFAULT_BASELINE = Path(__file__).parent / 'baseline.json'
+
+_bench_logger = logging.getLogger('benchmark')
+
+
+############
+# SERVICES #
+############
+def _local_storage(root_path, bucket_name):
+    from caelus.local.storages import LocalStorage
+
+    return LocalStorage(os.path.join(root_path, bucket_name))
+
+
+def _s3_storage(endpoint_url, bucket_name):
+    from caelus.aws.auth import AWSAuth
+    from caelus.aws.storages import S3Storage
+
+    auth = AWSAuth(key='testing', secret_key='testing', region_name='us-east-1')
+    s3 = S3Storage(auth, bucket_name=bucket_name, endpoint_url=endpoint_url)
+    s3.s3_client.create_bucket(Bucket=bucket_name)
+
+    return s3
+
+
+def _az_storage(connection_string, container_name):
+    from caelus.az.auth import AzureAuth
+    from caelus.az.storages import BlobStorage
+
+    auth = AzureAuth(connection_string=connection_string)
+    blob = BlobStorage(auth, account_name='devstoreaccount1', container_name=container_name)
+    blob.blob_service.create_container(container_name)
+
+    return blob
+
+
+def _gcp_storage(endpoint_url, bucket_name):
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import storage
+    from caelus.gcp.auth import GCPAuth
+    from caelus.gcp.storages import CloudStorage
+
+    auth = GCPAuth(project_id='caelus-benchmark', anonymous=True)
+    storage.Client(project=auth.project_id, credentials=AnonymousCredentials(),
+                   client_options={'api_endpoint': endpoint_url}).create_bucket(bucket_name)
+
+    return CloudStorage(auth, bucket_name=bucket_name, endpoint_url=endpoint_url)
+
+
+class _MotoServer(object):
+
+    def __init__(self, port):
+        from moto.server import ThreadedMotoServer
+
+        self._server = ThreadedMotoServer(port=port, verbose=False)
+        self.endpoint_url = f'http://127.0.0.1:{port}'
+
+    def __enter__(self):
+        self._server.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.stop()
+
+
+###########
+# METRICS #
+###########
+def _current_rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except FileNotFoundError:
+        # No procfs (macOS), fall back to the process high-water mark
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _PeakRSS(object):
+
+    def __init__(self, interval: float = 0.005):
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.start = 0
+        self.peak = 0
+
+    def _sample(self):
+        while not self._stop.wait(self._interval):
+            self.peak = max(self.peak, _current_rss())
+
+    def __enter__(self):
+        self.start = self.peak = _current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _current_rss())
+
+
+def _summarize(latencies, total_bytes, wall_time, rss):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'ops': len(latencies),
+        'bytes': total_bytes,
+        'throughput_mb_s': round(total_bytes / wall_time / 2 ** 20, 3) if wall_time > 0 else None,
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p90_ms': round(float(np.percentile(latencies, 90)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'max_ms': round(float(latencies.max()), 3),
+        'peak_rss_mb': round(rss.peak / 2 ** 20, 2),
+        'rss_growth_mb': round((rss.peak - rss.start) / 2 ** 20, 2),
+    }
+
+
+############
+# PAYLOADS #
+############
+def _parse_size(size: str) -> int:
+    units = {'KB': 2 ** 10, 'MB': 2 ** 20, 'GB': 2 ** 30}
+    size = size.strip().upper()
+    for unit, factor in units.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * factor)
+    return int(size)
+
+
+def _make_frame(size_bytes: int) -> pd.DataFrame:
+    # Around 64 bytes per serialized csv row
+    rows = max(size_bytes // 64, 1)
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'id': np.arange(rows),
+                         'value': rng.random(rows),
+                         'count': rng.integers(0, 1_000_000, rows),
+                         'label': rng.choice(['alpha', 'beta', 'gamma', 'delta'], rows)})
+
+
+def _make_payload(data_format: str, size_bytes: int):
+    if data_format == 'raw':
+        return os.urandom(size_bytes)
+    df = _make_frame(size_bytes)
+    if data_format in ('json', 'yaml'):
+        return {'records': df.to_dict(orient='records')}
+    return df
+
+
+def _payload_size(data_format: str, payload) -> int:
+    with io.BytesIO() as buff:
+        if data_format == 'raw':
+            return len(payload)
+        elif data_format == 'csv':
+            return len(payload.to_csv(index=False).encode())
+        elif data_format == 'excel':
+            payload.to_excel(buff, index=False)
+        elif data_format == 'parquet':
+            payload.to_parquet(buff, index=False)
+        elif data_format == 'json':
+            return len(json.dumps(payload).encode())
+        elif data_format == 'yaml':
+            return len(yaml.dump(payload).encode())
+        return buff.tell()
+
+
+def _writer(storage, data_format):
+    return {
+        'csv': lambda payload, name: storage.write_csv(payload, name, index=False),
+        'excel': lambda payload, name: storage.write_excel(payload, name, index=False),
+        'parquet': lambda payload, name: storage.write_parquet(payload, name, index=False),
+        'json': lambda payload, name: storage.write_json(payload, name),
+        'yaml': lambda payload, name: storage.write_yaml(payload, name),
+        'raw': lambda payload, name: storage.write_object(payload, name),
+    }[data_format]
+
+
+def _reader(storage, data_format):
+    return {
+        'csv': storage.read_csv,
+        'excel': storage.read_excel,
+        'parquet': storage.read_parquet,
+        'json': storage.read_json,
+        'yaml': storage.read_yaml,
+        'raw': storage.read_object,
+    }[data_format]
+
+
+#########
+# CASES #
+#########
+def _extension(data_format):
+    return {'excel': 'xlsx', 'raw': 'bin'}.get(data_format, data_format)
+
+
+def _timed(operation, names, payload=None):
+    latencies = []
+    for name in names:
+        start = time.perf_counter()
+        if payload is None:
+            operation(name)
+        else:
+            operation(payload, name)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_case(storage, data_format: str, size_bytes: int, count: int) -> dict:
+    payload = _make_payload(data_format, size_bytes)
+    payload_size = _payload_size(data_format, payload)
+    prefix = f'benchmark-{uuid.uuid4().hex[:8]}'
+    names = [f'{prefix}/object-{i}.{_extension(data_format)}' for i in range(count)]
+
+    results = {}
+    with _PeakRSS() as rss:
+        start = time.perf_counter()
+        latencies = _timed(_writer(storage, data_format), names, payload)
+        results['write'] = _summarize(latencies, payload_size * count, time.perf_counter() - start, rss)
+
+    del payload
+    with _PeakRSS() as rss:
+        start = time.perf_counter()
+        latencies = _timed(_reader(storage, data_format), names)
+        results['read'] = _summarize(latencies, payload_size * count, time.perf_counter() - start, rss)
+
+    with _PeakRSS() as rss:
+        start = time.perf_counter()
+        latencies = _timed(lambda folder: list(storage.list_objects(folder=folder)), [prefix])
+        results['list'] = _summarize(latencies, 0, time.perf_counter() - start, rss)
+
+    return results
+
+
+############
+# BASELINE #
+############
+def _flatten(results):
+    return {f'{backend}/{data_format}/{size}/{count}/{operation}': metrics
+            for backend, formats in results.items()
+            for data_format, sizes in formats.items()
+            for size, counts in sizes.items()
+            for count, operations in counts.items()
+            for operation, metrics in operations.items()}
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    baseline_cases = _flatten(baseline['results'])
+    for case, metrics in _flatten(results).items():
+        reference = baseline_cases.get(case)
+        if reference is None:
+            continue
+        if metrics['throughput_mb_s'] and reference['throughput_mb_s'] and \
+                metrics['throughput_mb_s'] < reference['throughput_mb_s'] * (1 - tolerance):
+            regressions.append(f'{case}: throughput {metrics["throughput_mb_s"]} MB/s '
+                               f'(baseline {reference["throughput_mb_s"]} MB/s)')
+        if metrics['p99_ms'] > reference['p99_ms'] * (1 + tolerance):
+            regressions.append(f'{case}: p99 {metrics["p99_ms"]} ms (baseline {reference["p99_ms"]} ms)')
+        if metrics['peak_rss_mb'] > reference['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f'{case}: peak RSS {metrics["peak_rss_mb"]} MB '
+                               f'(baseline {reference["peak_rss_mb"]} MB)')
+    return regressions
+
+
+def _print_table(results):
+    header = f'{"case":<48} {"MB/s":>10} {"p50 ms":>10} {"p90 ms":>10} {"p99 ms":>10} {"peak RSS MB":>12}'
+    print(header)
+    print('-' * len(header))
+    for case, metrics in _flatten(results).items():
+        print(f'{case:<48} {metrics["throughput_mb_s"] or 0:>10} {metrics["p50_ms"]:>10} {metrics["p90_ms"]:>10} '
+              f'{metrics["p99_ms"]:>10} {metrics["peak_rss_mb"]:>12}')
+
+
+@click.command()
+@click.option('-b', '--backend', 'backends', type=click.Choice(BACKENDS), multiple=True,
+              help='Backends to benchmark (default: all)')
+@click.option('-f', '--format', 'formats', type=click.Choice(FORMATS), multiple=True,
+              help='Formats to benchmark (default: all)')
+@click.option('-s', '--sizes', default='1KB,1MB,16MB', help='Comma separated payload sizes')
+@click.option('-c', '--counts', default='1,10', help='Comma separated object counts')
+@click.option('--max-excel-size', default='4MB', help='Skip excel payloads above this size')
+@click.option('--local-root', type=click.Path(), default=None, help='Root folder for the local backend')
+@click.option('--moto-port', default=5055, type=int, help='Port for the in-process moto server')
+@click.option('--s3-endpoint', default=None, help='Use an already running S3 stand-in instead of moto')
+@click.option('--azurite-connection-string', default=AZURITE_CONNECTION_STRING, help='Azurite connection string')
+@click.option('--gcs-endpoint', default='http://127.0.0.1:4443', help='fake-gcs-server endpoint')
+@click.option('-o', '--output', type=click.Path(), default=None, help='Write the results as json')
+@click.option('--baseline', type=click.Path(), default=str(DEFAULT_BASELINE), help='Baseline to compare with')
+@click.option('--save-baseline', is_flag=True, help='Store these results as the new baseline')
+@click.option('--tolerance', default=0.2, type=float, help='Allowed relative regression against the baseline')
+def storage_benchmark(backends, formats, sizes, counts, max_excel_size, local_root, moto_port, s3_endpoint,
+                      azurite_connection_string, gcs_endpoint, output, baseline, save_baseline, tolerance):
+    """
+    Benchmarks every caelus reader and writer against local stand-in services.
+
+    The local backend gives the no-network baseline. S3 runs against an in-process moto server.
+    Azure and GCP expect Azurite and fake-gcs-server running, e.g.
+
+        docker run -p 10000:10000 mcr.microsoft.com/azure-storage/azurite azurite-blob --blobHost 0.0.0.0
+
+        docker run -p 4443:4443 fsouza/fake-gcs-server -scheme http -public-host 127.0.0.1:4443
+    """
+    backends = backends or BACKENDS
+    formats = formats or FORMATS
+    sizes = [size.strip() for size in sizes.split(',')]
+    counts = [int(count) for count in counts.split(',')]
+    bucket_name = f'caelus-benchmark-{uuid.uuid4().hex[:8]}'
+
+    moto_server = None
+    local_tmp = None
+    storages = {}
+    if 'local' in backends:
+        if local_root is None:
+            local_root = local_tmp = tempfile.mkdtemp(prefix='caelus-benchmark-')
+        storages['local'] = lambda: _local_storage(local_root, bucket_name)
+    if 's3' in backends:
+        if s3_endpoint is None:
+            moto_server = _MotoServer(moto_port).__enter__()
+            s3_endpoint = moto_server.endpoint_url
+        storages['s3'] = lambda: _s3_storage(s3_endpoint, bucket_name)
+    if 'az' in backends:
+        storages['az'] = lambda: _az_storage(azurite_connection_string, bucket_name)
+    if 'gcp' in backends:
+        storages['gcp'] = lambda: _gcp_storage(gcs_endpoint, bucket_name)
+
+    results = {}
+    try:
+        for backend, storage_factory in storages.items():
+            storage = storage_factory()
+            for data_format in formats:
+                for size in sizes:
+                    size_bytes = _parse_size(size)
+                    if data_format == 'excel' and size_bytes > _parse_size(max_excel_size):
+                        continue
+                    for count in counts:
+                        _bench_logger.info(f'{backend} {data_format} {size} x{count}')
+                        results.setdefault(backend, {}).setdefault(data_format, {}).setdefault(size, {})[
+                            str(count)] = run_case(storage, data_format, size_bytes, count)
+    finally:
+        if moto_server is not None:
+            moto_server.__exit__(None, None, None)
+        if local_tmp is not None:
+            shutil.rmtree(local_tmp, ignore_errors=True)
+
+    _print_table(results)
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'machine': platform.machine(),
+              'results': results}
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if save_baseline:
+        with open(baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        _bench_logger.info(f'Baseline stored in {baseline}')
+    elif Path(baseline).exists():
+        with open(baseline) as f:
+            regressions = compare_with_baseline(results, json.load(f), tolerance)
+        for regression in regressions:
+            _bench_logger.warning(f'Regression in {regression}')
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    storage_benchmark.main()
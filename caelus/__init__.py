@@ -10,4 +10,5 @@ __all__ = [
     'aws',
     'az',
     'gcp',
+    'local',
 ]
@@ -16,8 +16,22 @@ class AWSAuth(object):
         self._profile_name = profile_name
         self._region_name = region_name
 
-        self._session = boto3.Session(aws_access_key_id=key, aws_secret_access_key=secret_key,
-                                      profile_name=profile_name, region_name=region_name)
+        self._session = self._create_session()
+
+    def _create_session(self):
+        return boto3.Session(aws_access_key_id=self._key, aws_secret_access_key=self._secret_key,
+                             profile_name=self._profile_name, region_name=self._region_name)
+
+    def __getstate__(self):
+        # Sessions are not picklable, the unpickled auth builds its own from the same arguments so profiles and the
+        # default credential chain are resolved, and refreshed, in that process
+        state = self.__dict__.copy()
+        state.pop('_session')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._session = self._create_session()
 
     @property
     def profile_name(self) -> str:
@@ -50,6 +64,19 @@ class AWSDelegatedAuth(AWSAuth):
 
         self.session = self.delegated_session
 
+    def __getstate__(self):
+        # Assuming the role again could ask for an MFA code, its temporary credentials are sent instead
+        state = AWSAuth.__getstate__(self)
+        credentials = self.session.get_credentials().get_frozen_credentials()
+        state['_role_credentials'] = (credentials.access_key, credentials.secret_key, credentials.token)
+        return state
+
+    def __setstate__(self, state):
+        access_key, secret_key, token = state.pop('_role_credentials')
+        self.__dict__.update(state)
+        self._session = boto3.Session(aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+                                      aws_session_token=token, region_name=self.region_name)
+
     @property
     def policy_name(self):
         return self._policy_name
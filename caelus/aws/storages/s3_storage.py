@@ -1,6 +1,11 @@
+import inspect
 import io
 import json
 import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Union, Generator
 from contextlib import contextmanager
 import pandas as pd
@@ -10,22 +15,80 @@ from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 
 from caelus.aws.auth import AWSAuth
-from caelus.core.storages import Storage
+from caelus.core.buffers import MemoryViewReader
+from caelus.core.checkpoints import Checkpoint
+from caelus.core.checksums import part_digests, s3_multipart_etag, file_digest, StreamingDigest, DigestReader, \
+    DigestWriter
+from caelus.core.compression import infer_compression
+from caelus.core.storages import Storage, ObjectStat
+from caelus.core.transfers import RangeConfig
 
 
 class S3Storage(Storage):
     _aws_logger = logging.getLogger('aws')
 
-    def __init__(self, auth: AWSAuth, bucket_name: str, base_path: str = "") -> None:
+    KMS_ENCRYPTIONS = ('aws:kms', 'aws:kms:dsse')
+
+    def __init__(self, auth: AWSAuth, bucket_name: str, base_path: str = "",
+                 endpoint_url: Union[None, str] = None) -> None:
         Storage.__init__(self, base_path=base_path)
 
         self.bucket_name = bucket_name
+        self._auth = auth
+        self._endpoint_url = endpoint_url
+
+        self.transfer_config = TransferConfig()
+
+    def __getstate__(self):
+        # TransferConfig keeps its values behind sentinels that do not survive pickling, its arguments are sent
+        state = Storage.__getstate__(self)
+        transfer_config = state.pop('_transfer_config')
+        state['_transfer_config_arguments'] = {name: getattr(transfer_config, name)
+                                               for name in inspect.signature(TransferConfig).parameters}
+        return state
+
+    def __setstate__(self, state):
+        transfer_config_arguments = state.pop('_transfer_config_arguments')
+        Storage.__setstate__(self, state)
+        self._transfer_config = TransferConfig(**transfer_config_arguments)
+
+    def _register_hooks(self, s3_client):
+        s3_client.meta.events.register('before-send.s3', self._throttle_request)
+        s3_client.meta.events.register('before-parameter-build.s3', self._request_started)
+        s3_client.meta.events.register('after-call.s3', self._request_finished)
+
+    def _request_started(self, params: dict, context: dict, **kwargs):
+        context['caelus_started'] = time.perf_counter(), params.get('Key', params.get('Prefix'))
+
+    def _request_finished(self, model, context: dict, **kwargs):
+        if 'caelus_started' in context:
+            started, path = context['caelus_started']
+            self._record_request(model.name, started, time.perf_counter(), path=path)
+
+    def _create_s3_client(self):
+        s3_client = self._auth.session.client('s3', endpoint_url=self._endpoint_url)
+        self._register_hooks(s3_client)
+        return s3_client
+
+    def _create_s3_resource(self):
+        s3_resource = self._auth.session.resource('s3', endpoint_url=self._endpoint_url)
+        self._register_hooks(s3_resource.meta.client)
+        return s3_resource
+
+    @property
+    def s3_client(self):
+        return self._client('s3_client', self._create_s3_client)
 
-        self.s3_client = auth.session.client('s3')
-        self.s3_resource = auth.session.resource('s3')
-        self.bucket = self.s3_resource.Bucket(bucket_name)
+    @property
+    def s3_resource(self):
+        return self._client('s3_resource', self._create_s3_resource)
+
+    @property
+    def bucket(self):
+        return self._client('bucket', lambda: self.s3_resource.Bucket(self.bucket_name))
 
-        self._transfer_config = None
+    def _object_uri(self, path: str) -> str:
+        return f's3://{self.bucket_name}/{path}'
 
     @property
     def transfer_config(self) -> TransferConfig:
@@ -33,7 +96,193 @@ class S3Storage(Storage):
 
     @transfer_config.setter
     def transfer_config(self, new_transfer_config):
+        if new_transfer_config is None:
+            new_transfer_config = TransferConfig()
         self._transfer_config = new_transfer_config
+        self.range_config = RangeConfig(threshold=new_transfer_config.multipart_threshold,
+                                        part_size=new_transfer_config.multipart_chunksize,
+                                        max_workers=new_transfer_config.max_concurrency
+                                        if new_transfer_config.use_threads else 1)
+
+    ##############
+    # PRIMITIVES #
+    ##############
+    def _stat(self, path: str) -> ObjectStat:
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket_name, Key=path)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(f'{path} not found in {self.bucket_name}') from e
+            raise
+        return self._response_stat(path, response['ContentLength'], response)
+
+    @classmethod
+    def _etag_is_opaque(cls, response: dict) -> bool:
+        return 'SSECustomerAlgorithm' in response or response.get('ServerSideEncryption') in cls.KMS_ENCRYPTIONS
+
+    @classmethod
+    def _response_stat(cls, path: str, size: int, response: dict) -> ObjectStat:
+        etag = response['ETag'].strip('"')
+        # Multipart ETags ("<md5>-<parts>") and the ETags of SSE-KMS or SSE-C objects are not the md5 of the object
+        etag_is_md5 = '-' not in etag and not cls._etag_is_opaque(response)
+        return ObjectStat(name=path, size=size, etag=etag, md5=etag if etag_is_md5 else None,
+                          last_modified=response['LastModified'], content_type=response.get('ContentType'))
+
+    def _list_stats(self, prefix: str) -> Generator:
+        # Listings have no content type nor encryption, the stats they give have content_type and md5 None
+        for page in self.s3_client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield self._response_stat(item['Key'], item['Size'], item)._replace(md5=None)
+
+    def _read_range(self, path: str, start: int, end: int, etag: Union[str, None] = None) -> bytes:
+        if end <= start:
+            return b''
+        conditions = {} if etag is None else {'IfMatch': f'"{etag}"'}
+        return self.s3_client.get_object(Bucket=self.bucket_name, Key=path, Range=f'bytes={start}-{end - 1}',
+                                         **conditions)['Body'].read()
+
+    def _read_first_range(self, path: str, end: int):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=path, Range=f'bytes=0-{end - 1}')
+        except ClientError as e:
+            # Empty objects can not be ranged
+            if e.response['Error']['Code'] == 'InvalidRange':
+                return b'', self._stat(path)
+            raise
+        content_range = response.get('ContentRange')
+        size = int(content_range.rpartition('/')[2]) if content_range else response['ContentLength']
+        return response['Body'].read(), self._response_stat(path, size, response)
+
+    def _read_if_none_match(self, path: str, etag: Union[str, None]):
+        conditions = {} if etag is None else {'IfNoneMatch': f'"{etag}"'}
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=path, **conditions)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('304', 'NotModified'):
+                return None, ObjectStat(name=path, size=None, etag=etag, md5=None, last_modified=None,
+                                        content_type=None)
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                raise FileNotFoundError(f'{path} not found in {self.bucket_name}') from e
+            raise
+        data = response['Body'].read()
+        self._throttle_bytes(len(data))
+        return data, self._response_stat(path, response['ContentLength'], response)
+
+    @contextmanager
+    def _open_stream(self, path: str):
+        body = self.s3_client.get_object(Bucket=self.bucket_name, Key=path)['Body']
+        try:
+            yield body
+        finally:
+            body.close()
+
+    def _resumable_part_size(self) -> int:
+        return self.transfer_config.multipart_chunksize
+
+    def _resumable_upload(self, local_path: str, path: str, checkpoint: Checkpoint, **kwargs):
+        extra_args = kwargs.pop('ExtraArgs', None) or {}
+        if kwargs:
+            raise ValueError(f'Resumable uploads only accept ExtraArgs, got {", ".join(kwargs)}')
+        size = os.path.getsize(local_path)
+        part_size = self._resumable_part_size()
+        if size < self.transfer_config.multipart_threshold:
+            self.s3_client.upload_file(local_path, self.bucket_name, path, ExtraArgs=extra_args,
+                                       Config=self.transfer_config, Callback=self._bytes_callback())
+            return
+
+        state = checkpoint.state
+        if 'upload_id' not in state:
+            state['upload_id'] = self.s3_client.create_multipart_upload(Bucket=self.bucket_name, Key=path,
+                                                                        **extra_args)['UploadId']
+            state['parts'] = {}
+            checkpoint.save()
+        # Parts of objects encrypted with a customer key are sent with the same key
+        part_args = {key: value for key, value in extra_args.items() if key.startswith('SSECustomer')}
+        lock = threading.Lock()
+
+        def upload_part(part_number):
+            with open(local_path, 'rb') as f:
+                f.seek((part_number - 1) * part_size)
+                data = f.read(part_size)
+            self._throttle_bytes(len(data))
+            etag = self.s3_client.upload_part(Bucket=self.bucket_name, Key=path, UploadId=state['upload_id'],
+                                              PartNumber=part_number, Body=data, **part_args)['ETag']
+            with lock:
+                state['parts'][str(part_number)] = etag
+                checkpoint.save()
+
+        part_numbers = range(1, -(-size // part_size) + 1)
+        try:
+            with self._executor(self.transfer_config.max_concurrency if self.transfer_config.use_threads else 1,
+                                'part') as executor:
+                for future in [executor.submit(upload_part, part_number) for part_number in part_numbers
+                               if str(part_number) not in state['parts']]:
+                    future.result()
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name, Key=path, UploadId=state['upload_id'],
+                MultipartUpload={'Parts': [{'PartNumber': part_number, 'ETag': state['parts'][str(part_number)]}
+                                           for part_number in part_numbers]})
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchUpload':
+                raise
+            # Aborted or expired by a lifecycle rule, starting over
+            self._aws_logger.warning(f'Multipart upload of {path} no longer exists, restarting it')
+            state.clear()
+            self._resumable_upload(local_path, path, checkpoint, ExtraArgs=extra_args)
+
+    def _abort_resumable_upload(self, path: str, state: dict):
+        if 'upload_id' in state:
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=path, UploadId=state['upload_id'])
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'NoSuchUpload':
+                    raise
+
+    def abort_stale_uploads(self, older_than: timedelta, folder: Union[str, None] = None) -> int:
+        limit = datetime.now(timezone.utc) - older_than
+        aborted = 0
+        for page in self.s3_client.get_paginator('list_multipart_uploads').paginate(
+                Bucket=self.bucket_name, Prefix=self._get_folder_path(folder)):
+            for upload in page.get('Uploads', []):
+                if upload['Initiated'] < limit:
+                    self._abort_resumable_upload(upload['Key'], {'upload_id': upload['UploadId']})
+                    self._aws_logger.debug(f'Aborted multipart upload of {upload["Key"]}')
+                    aborted += 1
+        return aborted
+
+    def _bytes_callback(self):
+        return None if self.rate_limiter is None else self._throttle_bytes
+
+    def _checksum_matches(self, stat: ObjectStat, fileobj) -> bool:
+        md5, parts = part_digests(fileobj, self.transfer_config.multipart_chunksize)
+        if '-' in stat.etag:
+            return stat.etag == s3_multipart_etag(parts)
+        return stat.etag == md5
+
+    def _verify_s3_digest(self, path: str, digest: StreamingDigest):
+        kwargs = {}
+        if 'ChecksumMode' in self.s3_client.meta.service_model.operation_model('HeadObject').input_shape.members:
+            # Older botocore versions do not know the checksum parameters, the ETag is checked alone
+            kwargs['ChecksumMode'] = 'ENABLED'
+        response = self.s3_client.head_object(Bucket=self.bucket_name, Key=path, **kwargs)
+        etag = response['ETag'].strip('"')
+        crc32c = response.get('ChecksumCRC32C')
+        if crc32c is not None and '-' in crc32c:
+            # Checksum of the part checksums
+            crc32c = None
+        if self._etag_is_opaque(response):
+            self._verify_digest(path, digest, crc32c=crc32c)
+        elif '-' not in etag:
+            self._verify_digest(path, digest, md5=etag, crc32c=crc32c)
+        elif etag.rpartition('-')[2] == digest.multipart_etag().rpartition('-')[2]:
+            self._verify_digest(path, digest, crc32c=crc32c, multipart_etag=etag)
+        else:
+            # Uploaded with another part size
+            self._verify_digest(path, digest, crc32c=crc32c)
+
+    def _upload_fileobj(self, fileobj, path: str, **kwargs):
+        kwargs.setdefault('Callback', self._bytes_callback())
+        self.s3_client.upload_fileobj(fileobj, self.bucket_name, path, Config=self.transfer_config, **kwargs)
 
     ################
     # OBJECT ADMIN #
@@ -99,34 +348,22 @@ class S3Storage(Storage):
     def _read_to_buffer(self, path):
         self._aws_logger.debug(f'Reading from {self.bucket_name}: {path}')
 
-        with io.BytesIO() as buff:
-            buff = self.s3_client.get_object(Bucket=self.bucket_name, Key=path)['Body']
-            yield buff
-
-    @contextmanager
-    def _download_to_buffer(self, path):
-        self._aws_logger.debug(f'Reading from {self.bucket_name}: {path}')
-
-        with io.BytesIO() as buff:
-            s3_object = self.s3_resource.Object(self.bucket_name, path)
-            s3_object.download_fileobj(buff)
+        with MemoryViewReader(self._download_to_memory(path)) as buff:
             yield buff
 
     def read_csv(self, filename: str, folder: Union[str, None] = None, **kwargs):
-        with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
-            return pd.read_csv(buff, **kwargs)
+        return self._read_parsed(self._get_full_path(filename, folder), 'csv', kwargs)
 
     def read_excel(self, filename: str, folder: Union[str, None] = None, **kwargs):
-        with self._download_to_buffer(self._get_full_path(filename, folder)) as buff:
-            return pd.read_excel(buff, **kwargs)
+        return self._read_parsed(self._get_full_path(filename, folder), 'excel', kwargs)
 
     def read_parquet(self, filename: str, folder: Union[str, None] = None, **kwargs):
-        with self._download_to_buffer(self._get_full_path(filename, folder)) as buff:
+        with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
             return pd.read_parquet(buff, **kwargs)
 
     def read_yaml(self, filename: str, folder=None, yaml_loader=yaml.FullLoader):
         with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
-            return yaml.load(buff, Loader=yaml_loader)
+            return self._parse_buffer('yaml', buff, yaml_loader=yaml_loader)
 
     def read_json(self, filename: str, folder=None, **kwargs):
         with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
@@ -136,13 +373,80 @@ class S3Storage(Storage):
         with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
             return buff.read(**kwargs)
 
+    def _select_records(self, path: str, sql: str, input_serialization: dict) -> Generator:
+        response = self.s3_client.select_object_content(Bucket=self.bucket_name, Key=path, Expression=sql,
+                                                        ExpressionType='SQL', InputSerialization=input_serialization,
+                                                        OutputSerialization={'JSON': {'RecordDelimiter': '\n'}})
+        # Record events are split at arbitrary bytes, the last line of every payload may be incomplete
+        partial = b''
+        for event in response['Payload']:
+            if 'Records' in event:
+                self._throttle_bytes(len(event['Records']['Payload']))
+                lines = (partial + event['Records']['Payload']).split(b'\n')
+                partial = lines.pop()
+                for line in lines:
+                    if line:
+                        yield json.loads(line)
+        if partial:
+            yield json.loads(partial)
+
+    @staticmethod
+    def _select_dataframes(records, chunksize: int) -> Generator:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == chunksize:
+                yield pd.DataFrame.from_records(batch)
+                batch = []
+        if batch:
+            yield pd.DataFrame.from_records(batch)
+
+    def select(self, filename: str, sql: str, folder: Union[str, None] = None, input_format: str = 'csv',
+               output: str = 'dataframe', chunksize: Union[int, None] = None, compression: Union[str, None] = 'infer',
+               input_serialization: Union[dict, None] = None):
+        # S3 Select runs the filter and the projection server side (FROM s3object), only matching rows are sent.
+        # Returns a DataFrame, a generator of chunksize DataFrames, or a generator of records
+        path = self._get_full_path(filename, folder)
+        if input_serialization is None:
+            formats = {'csv': {'CSV': {'FileHeaderInfo': 'USE'}}, 'json': {'JSON': {'Type': 'LINES'}},
+                       'parquet': {'Parquet': {}}}
+            if input_format not in formats:
+                raise ValueError(f'Unknown input format {input_format}, use one of {", ".join(formats)}')
+            input_serialization = dict(formats[input_format])
+            if input_format != 'parquet':
+                compressions = {None: 'NONE', 'gzip': 'GZIP', 'bz2': 'BZIP2'}
+                compression = infer_compression(path, compression)
+                if compression not in compressions:
+                    raise ValueError(f'S3 Select can not read {compression} objects, use gzip, bz2 or no compression')
+                input_serialization['CompressionType'] = compressions[compression]
+
+        self._aws_logger.debug(f'Selecting from {self.bucket_name}: {path}')
+        records = self._select_records(path, sql, input_serialization)
+        if output == 'records':
+            return records
+        elif output != 'dataframe':
+            raise ValueError(f'Unknown output {output}, use dataframe or records')
+        elif chunksize is not None:
+            return self._select_dataframes(records, chunksize)
+        return pd.DataFrame.from_records(list(records))
+
     def read_object_to_file(self, object_filename: str, filename: Union[str, None] = None,
-                            folder: Union[str, None] = None, **kwargs):
+                            folder: Union[str, None] = None, resumable: bool = False,
+                            checkpoint_dir: Union[str, None] = None, verify: bool = False, **kwargs):
         object_filename_full, filename = self._create_local_path(object_filename, filename, folder)
+        if resumable:
+            self._read_resumable(object_filename_full, filename, checkpoint_dir)
+            return
         with open(filename, 'wb') as f:
             self._aws_logger.debug(f'Downloading {object_filename_full} to {filename}')
-            self.s3_client.download_fileobj(self.bucket_name, object_filename_full, f, Config=self.transfer_config,
-                                            **kwargs)
+            kwargs.setdefault('Callback', self._bytes_callback())
+            digest = StreamingDigest(self.transfer_config.multipart_chunksize) if verify else None
+            # Parts written to a non-seekable file are put back in order by the transfer manager
+            self.s3_client.download_fileobj(self.bucket_name, object_filename_full,
+                                            f if digest is None else DigestWriter(f, digest),
+                                            Config=self.transfer_config, **kwargs)
+        if verify:
+            self._verify_s3_digest(object_filename_full, digest)
 
     ###########
     # WRITERS #
@@ -153,44 +457,68 @@ class S3Storage(Storage):
 
         return bucket_path
 
-    def write_csv(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_csv(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                  if_changed: bool = False, **kwargs):
         with io.StringIO() as buff:
             df.to_csv(buff, **kwargs)
-            self.s3_resource.Object(self.bucket_name, self._get_bucket_path(filename, folder)).put(Body=buff.getvalue())
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
 
-    def write_excel(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_excel(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                    if_changed: bool = False, **kwargs):
         with io.BytesIO() as buff:
             df.to_excel(buff, **kwargs)
-            self.s3_resource.Object(self.bucket_name, self._get_bucket_path(filename, folder)).put(Body=buff.getvalue())
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
 
-    def write_parquet(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_parquet(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                      if_changed: bool = False, **kwargs):
         with io.BytesIO() as buff:
             df.to_parquet(buff, **kwargs)
-            self.s3_resource.Object(self.bucket_name, self._get_bucket_path(filename, folder)).put(Body=buff.getvalue())
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
 
-    def write_yaml(self, data: dict, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_yaml(self, data: dict, filename: str, folder: Union[str, None] = None,
+                   if_changed: bool = False, **kwargs):
         with io.StringIO() as buff:
             yaml.dump(data, buff, **kwargs)
-            self.s3_resource.Object(self.bucket_name, self._get_bucket_path(filename, folder)).put(Body=buff.getvalue())
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
 
-    def write_json(self, data: dict, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_json(self, data: dict, filename: str, folder: Union[str, None] = None,
+                   if_changed: bool = False, **kwargs):
         with io.StringIO() as buff:
             json.dump(data, buff, **kwargs)
-            self.s3_resource.Object(self.bucket_name, self._get_bucket_path(filename, folder)).put(Body=buff.getvalue())
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
 
-    def write_object(self, write_object, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_object(self, write_object, filename: str, folder: Union[str, None] = None,
+                     if_changed: bool = False, **kwargs):
         if isinstance(write_object, bytes):
-            self.s3_resource.Object(self.bucket_name, self._get_bucket_path(filename, folder)).put(
-                Body=write_object)
+            self._upload_buffer(io.BytesIO(write_object), self._get_bucket_path(filename, folder),
+                                if_changed=if_changed)
         elif isinstance(write_object, io.BytesIO):
-            self.s3_resource.Object(self.bucket_name, self._get_bucket_path(filename, folder)).put(
-                Body=write_object.getvalue())
+            self._upload_buffer(write_object, self._get_bucket_path(filename, folder), if_changed=if_changed)
         else:
-            self.s3_resource.Object(self.bucket_name, self._get_bucket_path(filename, folder)).upload_fileobj(
-                write_object, Config=self.transfer_config, **kwargs)
-
-    def write_object_from_file(self, object_filename: str, filename: str, folder: Union[str, None] = None, **kwargs):
-        self.s3_resource.Object(self.bucket_name,
-                                self._get_bucket_path(filename, folder)).upload_file(object_filename,
-                                                                                     Config=self.transfer_config,
-                                                                                     **kwargs)
+            self._upload_stream(write_object, self._get_bucket_path(filename, folder), if_changed=if_changed,
+                                **kwargs)
+
+    def write_object_from_file(self, object_filename: str, filename: str, folder: Union[str, None] = None,
+                               if_changed: bool = False, resumable: bool = False,
+                               checkpoint_dir: Union[str, None] = None, verify: bool = False, **kwargs):
+        bucket_path = self._get_bucket_path(filename, folder)
+        if if_changed and self._skip_unchanged_file(object_filename, bucket_path):
+            return
+        if resumable:
+            self._write_resumable(object_filename, bucket_path, checkpoint_dir, **kwargs)
+            if verify:
+                # Parts sent in earlier runs are not hashed again on resume, the file is hashed once complete
+                self._verify_s3_digest(bucket_path, file_digest(object_filename, self._resumable_part_size()))
+            return
+        if verify:
+            # Read in order from a non-seekable stream, the digest is computed in the same pass as the upload
+            digest = StreamingDigest(self.transfer_config.multipart_chunksize)
+            with open(object_filename, 'rb') as f:
+                self._upload_fileobj(DigestReader(f, digest), bucket_path, **kwargs)
+            self._verify_s3_digest(bucket_path, digest)
+            self._record_upload('uploaded')
+            return
+        kwargs.setdefault('Callback', self._bytes_callback())
+        self.s3_resource.Object(self.bucket_name, bucket_path).upload_file(object_filename,
+                                                                           Config=self.transfer_config, **kwargs)
+        self._record_upload('uploaded')
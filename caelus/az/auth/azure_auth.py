@@ -43,6 +43,11 @@ class AzureAuth(object):
             # Authenticating with DefaultAzureCredential
             raise ClientAuthenticationError('Some credentials are required')
 
+    def __reduce__(self):
+        # Rebuilt from the construction parameters, a service principal gets a fresh token in the receiving process
+        return self.__class__, (self._tenant_id, self._client_id, self._client_secret, self._resource,
+                                self._key_token, self._connection_string_token)
+
     @property
     def key_token(self) -> str:
         return self._key_token
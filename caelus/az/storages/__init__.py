@@ -1,5 +1,6 @@
-from .blob_storage import BlobStorage
+from .blob_storage import BlobStorage, BlobTransferConfig
 
 __all__ = [
     'BlobStorage',
+    'BlobTransferConfig',
 ]
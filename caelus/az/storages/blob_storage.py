@@ -1,6 +1,11 @@
+import copy
 import io
 import json
 import logging
+import mimetypes
+import os
+import threading
+import time
 from contextlib import contextmanager
 from typing import Union, Generator
 
@@ -8,10 +13,27 @@ import pandas as pd
 import yaml
 
 from caelus.az.auth import AzureAuth
-from caelus.core.storages import Storage
-from azure.storage.blob import BlockBlobService
+from caelus.core.buffers import MemoryViewReader
+from caelus.core.checkpoints import Checkpoint
+from caelus.core.checksums import b64_to_hex, hex_to_b64, part_digests, HashingReader
+from caelus.core.storages import Storage, ObjectStat
+from caelus.core.transfers import RangeConfig, MB
+from azure.common import AzureHttpError, AzureMissingResourceHttpError
+from azure.storage.blob import BlockBlobService, ContentSettings
 from azure.storage.common import TokenCredential
-from azure.storage.blob.models import Blob
+from azure.storage.blob.models import Blob, BlobBlock, Include
+
+
+class BlobTransferConfig(object):
+
+    def __init__(self, max_connections: int = 2, max_block_size: int = 4 * MB, max_single_put_size: int = 64 * MB,
+                 max_single_get_size: int = 32 * MB, max_chunk_get_size: int = 4 * MB):
+        # Defaults are the ones of BlockBlobService
+        self.max_connections = max_connections
+        self.max_block_size = max_block_size
+        self.max_single_put_size = max_single_put_size
+        self.max_single_get_size = max_single_get_size
+        self.max_chunk_get_size = max_chunk_get_size
 
 
 class BlobStorage(Storage):
@@ -22,21 +44,222 @@ class BlobStorage(Storage):
         Storage.__init__(self, base_path=base_path)
 
         self.container_name = container_name
-        self.blob_service = BlockBlobService(account_name=account_name, account_key=auth.key_token,
-                                             token_credential=TokenCredential(auth.service_principal_token),
-                                             connection_string=auth.connection_string_token)
+        self._auth = auth
+        self._account_name = account_name
+
+        self.transfer_config = BlobTransferConfig()
+
+    def _create_blob_service(self) -> BlockBlobService:
+        blob_service = BlockBlobService(account_name=self._account_name, account_key=self._auth.key_token,
+                                        token_credential=TokenCredential(self._auth.service_principal_token),
+                                        connection_string=self._auth.connection_string_token)
+        # Called around every request sent by the service, including the parallel block transfers
+        started = threading.local()
+
+        def request_callback(request):
+            self._throttle_request()
+            started.request = time.perf_counter(), request.method, request.path
+
+        def response_callback(response):
+            start, method, path = started.request
+            self._record_request(method, start, time.perf_counter(), path=path, status=response.status)
+
+        blob_service.request_callback = request_callback
+        blob_service.response_callback = response_callback
+        self._configure_blob_service(blob_service)
+        return blob_service
+
+    def _configure_blob_service(self, blob_service: BlockBlobService):
+        blob_service.MAX_BLOCK_SIZE = self.transfer_config.max_block_size
+        blob_service.MAX_SINGLE_PUT_SIZE = self.transfer_config.max_single_put_size
+        blob_service.MAX_SINGLE_GET_SIZE = self.transfer_config.max_single_get_size
+        blob_service.MAX_CHUNK_GET_SIZE = self.transfer_config.max_chunk_get_size
+
+    @property
+    def blob_service(self) -> BlockBlobService:
+        return self._client('blob_service', self._create_blob_service)
+
+    def _object_uri(self, path: str) -> str:
+        return f'https://{self._account_name}.blob.core.windows.net/{self.container_name}/{path}'
+
+    @property
+    def transfer_config(self) -> BlobTransferConfig:
+        return self._transfer_config
+
+    @transfer_config.setter
+    def transfer_config(self, new_transfer_config):
+        self._transfer_config = new_transfer_config
+
+        blob_service = self._process_clients().get('blob_service')
+        if blob_service is not None:
+            self._configure_blob_service(blob_service)
+        self.range_config = RangeConfig(threshold=new_transfer_config.max_single_get_size,
+                                        part_size=new_transfer_config.max_chunk_get_size,
+                                        max_workers=new_transfer_config.max_connections)
+
+    ##############
+    # PRIMITIVES #
+    ##############
+    def _stat(self, path: str) -> ObjectStat:
+        try:
+            properties = self.blob_service.get_blob_properties(self.container_name, path).properties
+        except AzureMissingResourceHttpError as e:
+            raise FileNotFoundError(f'{path} not found in {self.container_name}') from e
+        return self._properties_stat(path, properties.content_length, properties)
+
+    @staticmethod
+    def _properties_stat(path: str, size: int, properties) -> ObjectStat:
+        return ObjectStat(name=path, size=size, etag=properties.etag.strip('"'),
+                          md5=b64_to_hex(properties.content_settings.content_md5),
+                          last_modified=properties.last_modified,
+                          content_type=properties.content_settings.content_type)
+
+    def _list_stats(self, prefix: str) -> Generator:
+        for blob in self.blob_service.list_blobs(self.container_name, prefix=prefix):
+            yield self._properties_stat(blob.name, blob.properties.content_length, blob.properties)
+
+    def _read_range(self, path: str, start: int, end: int, etag: Union[str, None] = None) -> bytes:
+        if end <= start:
+            return b''
+        return self.blob_service.get_blob_to_bytes(self.container_name, path, start_range=start, end_range=end - 1,
+                                                   if_match=None if etag is None else f'"{etag}"',
+                                                   max_connections=1).content
+
+    def _read_first_range(self, path: str, end: int):
+        try:
+            blob = self.blob_service.get_blob_to_bytes(self.container_name, path, start_range=0, end_range=end - 1,
+                                                       max_connections=1)
+        except AzureHttpError as e:
+            # Empty blobs can not be ranged
+            if e.status_code == 416:
+                return b'', self._stat(path)
+            raise
+        content_range = blob.properties.content_range
+        size = int(content_range.rpartition('/')[2]) if content_range else len(blob.content)
+        return blob.content, self._properties_stat(path, size, blob.properties)
+
+    def _read_if_none_match(self, path: str, etag: Union[str, None]):
+        try:
+            blob = self.blob_service.get_blob_to_bytes(self.container_name, path,
+                                                       if_none_match=None if etag is None else f'"{etag}"',
+                                                       max_connections=1)
+        except AzureMissingResourceHttpError as e:
+            raise FileNotFoundError(f'{path} not found in {self.container_name}') from e
+        except AzureHttpError as e:
+            if e.status_code == 304:
+                return None, ObjectStat(name=path, size=None, etag=etag, md5=None, last_modified=None,
+                                        content_type=None)
+            raise
+        self._throttle_bytes(len(blob.content))
+        return blob.content, self._properties_stat(path, len(blob.content), blob.properties)
+
+    def _upload_fileobj(self, fileobj, path: str, **kwargs):
+        size = self._remaining_size(fileobj)
+        # Parallel block uploads of a seekable stream seek it, other streams are read in order by the SDK
+        kwargs.setdefault('max_connections', self.transfer_config.max_connections if size is not None else 1)
+        if size is not None:
+            # The SDK sends a single Put Blob only for a known count up to max_single_put_size
+            kwargs.setdefault('count', size)
+        content_settings = kwargs.get('content_settings')
+        hashing_reader = None
+        if (size is None or size > self.transfer_config.max_single_put_size) and \
+                (content_settings is None or content_settings.content_md5 is None):
+            # Put Blob stores the Content-MD5 on its own, committed block lists do not. The blocks are hashed while
+            # they are read and the MD5 is set once the list is committed
+            fileobj = hashing_reader = HashingReader(fileobj)
+        kwargs.setdefault('progress_callback', self._progress_callback())
+        self.blob_service.create_blob_from_stream(container_name=self.container_name, blob_name=path,
+                                                  stream=fileobj, **kwargs)
+        if hashing_reader is not None:
+            # Setting the properties replaces all of them, the ones of the upload are sent again
+            content_settings = ContentSettings() if content_settings is None else copy.copy(content_settings)
+            content_settings.content_type = content_settings.content_type or 'application/octet-stream'
+            content_settings.content_md5 = hex_to_b64(hashing_reader.hexdigest())
+            self.blob_service.set_blob_properties(self.container_name, path, content_settings=content_settings)
+
+    @staticmethod
+    def _text_content_settings(path: str) -> ContentSettings:
+        content_type = mimetypes.guess_type(path)[0] or 'text/plain'
+        return ContentSettings(content_type=f'{content_type}; charset=utf-8')
+
+    def _resumable_part_size(self) -> int:
+        return self.transfer_config.max_block_size
+
+    def _resumable_upload(self, local_path: str, path: str, checkpoint: Checkpoint, **kwargs):
+        unsupported = set(kwargs) - {'content_settings', 'metadata', 'validate_content'}
+        if unsupported:
+            raise ValueError(f'Resumable uploads only accept content_settings, metadata and validate_content, got '
+                             f'{", ".join(sorted(unsupported))}')
+        size = os.path.getsize(local_path)
+        block_size = self._resumable_part_size()
+        if size <= self.transfer_config.max_single_put_size:
+            with open(local_path, 'rb') as f:
+                self._upload_fileobj(f, path, **kwargs)
+            return
+
+        # Uncommitted blocks are kept by the service for a week, their ids are deterministic so they are found again
+        state = checkpoint.state
+        state.setdefault('blocks', [])
+        block_ids = [f'{index:08d}' for index in range(-(-size // block_size))]
+        uploaded = set(state['blocks'])
+        lock = threading.Lock()
+
+        def put_block(index):
+            with open(local_path, 'rb') as f:
+                f.seek(index * block_size)
+                data = f.read(block_size)
+            self._throttle_bytes(len(data))
+            self.blob_service.put_block(self.container_name, path, data, block_ids[index],
+                                        validate_content=kwargs.get('validate_content', False))
+            with lock:
+                state['blocks'].append(block_ids[index])
+                checkpoint.save()
+
+        with self._executor(self.transfer_config.max_connections, 'block') as executor:
+            for future in [executor.submit(put_block, index) for index, block_id in enumerate(block_ids)
+                           if block_id not in uploaded]:
+                future.result()
+
+        with open(local_path, 'rb') as f:
+            md5 = part_digests(f, block_size)[0]
+        content_settings = kwargs.get('content_settings')
+        content_settings = ContentSettings() if content_settings is None else copy.copy(content_settings)
+        content_settings.content_md5 = hex_to_b64(md5)
+        try:
+            self.blob_service.put_block_list(self.container_name, path,
+                                             [BlobBlock(id=block_id) for block_id in block_ids],
+                                             content_settings=content_settings, metadata=kwargs.get('metadata'))
+        except AzureHttpError as e:
+            if e.status_code != 400 or 'InvalidBlockList' not in str(e):
+                raise
+            # The uncommitted blocks expired, starting over
+            self._az_logger.warning(f'Uncommitted blocks of {path} are gone, restarting the upload')
+            state.clear()
+            self._resumable_upload(local_path, path, checkpoint, **kwargs)
 
     ################
     # OBJECT ADMIN #
     ################
     def _list_blob_objects(self, prefix: str, filter_filename: Union[None, str] = None,
-                           filter_extension: Union[None, str, tuple] = None) -> Generator:
-        objects_generator = self.blob_service.list_blobs(self.container_name, prefix=prefix)
-
-        for key in objects_generator:
-            filtered_key = self._filter_key(key, filter_filename, filter_extension)
-            if filtered_key is not None:
-                yield filtered_key
+                           filter_extension: Union[None, str, tuple] = None, page_size: Union[int, None] = None,
+                           max_results: Union[int, None] = None, include: Union[Include, None] = None) -> Generator:
+        marker = None
+        remaining = max_results
+        while remaining is None or remaining > 0:
+            num_results = page_size if remaining is None else min(page_size or remaining, remaining)
+            # Only the items of this page are read, iterating the generator would request the next ones again
+            page = self.blob_service.list_blobs(self.container_name, prefix=prefix, num_results=num_results,
+                                                include=include, marker=marker)
+            for key in page.items:
+                filtered_key = self._filter_key(key, filter_filename, filter_extension)
+                if filtered_key is not None:
+                    yield filtered_key
+
+            if remaining is not None:
+                remaining -= len(page.items)
+            marker = page.next_marker
+            if not marker:
+                break
 
     @staticmethod
     def _filter_key(key, filter_filename, filter_extension):
@@ -48,9 +271,12 @@ class BlobStorage(Storage):
             return key
 
     def list_objects(self, folder: Union[None, str] = None, filter_filename: Union[None, str] = None,
-                     filter_extension: Union[None, str, tuple] = None) -> Generator:
+                     filter_extension: Union[None, str, tuple] = None, page_size: Union[int, None] = None,
+                     max_results: Union[int, None] = None, include: Union[Include, None] = None) -> Generator:
+        # page_size is capped at 5000 by the service, include adds metadata, snapshots, copy or deleted details
         return self._list_blob_objects(self._get_folder_path(folder), filter_filename=filter_filename,
-                                       filter_extension=filter_extension)
+                                       filter_extension=filter_extension, page_size=page_size,
+                                       max_results=max_results, include=include)
 
     def _blob_copy(self, dest_container_name: str, blob_name: str, dest_object_name: Union[str, None],
                    remove_copied: bool):
@@ -86,9 +312,8 @@ class BlobStorage(Storage):
     def _read_to_buffer(self, path):
         self._az_logger.debug(f'Reading from {self.container_name}: {path}')
 
-        with io.BytesIO() as buff:
-            buff = self.blob_service.get_blob_to_bytes(container_name=self.container_name, blob_name=path).content
-            yield io.BytesIO(buff)
+        with MemoryViewReader(self._download_to_memory(path)) as buff:
+            yield buff
 
     @contextmanager
     def _read_to_str_buffer(self, path):
@@ -99,12 +324,10 @@ class BlobStorage(Storage):
             yield io.StringIO(buff)
 
     def read_csv(self, filename: str, folder: Union[str, None] = None, **kwargs):
-        with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
-            return pd.read_csv(buff, **kwargs)
+        return self._read_parsed(self._get_full_path(filename, folder), 'csv', kwargs)
 
     def read_excel(self, filename: str, folder: Union[str, None] = None, **kwargs):
-        with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
-            return pd.read_excel(buff, **kwargs)
+        return self._read_parsed(self._get_full_path(filename, folder), 'excel', kwargs)
 
     def read_parquet(self, filename: str, folder: Union[str, None] = None, **kwargs):
         with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
@@ -112,7 +335,7 @@ class BlobStorage(Storage):
 
     def read_yaml(self, filename: str, folder=None, yaml_loader=yaml.FullLoader):
         with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
-            return yaml.load(buff, Loader=yaml_loader)
+            return self._parse_buffer('yaml', buff, yaml_loader=yaml_loader)
 
     def read_json(self, filename: str, folder=None, **kwargs):
         with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
@@ -123,13 +346,20 @@ class BlobStorage(Storage):
             return buff.read(**kwargs)
 
     def read_object_to_file(self, blob_object: Blob, filename: Union[str, None] = None,
-                            folder: Union[str, None] = None, **kwargs):
+                            folder: Union[str, None] = None, resumable: bool = False,
+                            checkpoint_dir: Union[str, None] = None, verify: bool = False, **kwargs):
         object_filename_full, filename = self._create_local_path(blob_object.name, filename, folder)
+        if resumable:
+            self._read_resumable(object_filename_full, filename, checkpoint_dir)
+            return
 
         with open(filename, 'wb') as f:
             self._az_logger.debug(f'Downloading {object_filename_full} to {filename}')
-            retrieved_blob = self.blob_service.get_blob_to_bytes(self.container_name, object_filename_full)
-            f.write(retrieved_blob.content)
+            kwargs.setdefault('max_connections', self.transfer_config.max_connections)
+            kwargs.setdefault('progress_callback', self._progress_callback())
+            # The MD5 of every range is computed by the service and checked as it arrives, ranges stay under 4MB
+            kwargs.setdefault('validate_content', verify)
+            self.blob_service.get_blob_to_stream(self.container_name, object_filename_full, f, **kwargs)
 
     ###########
     # WRITERS #
@@ -140,56 +370,60 @@ class BlobStorage(Storage):
 
         return bucket_path
 
-    def write_csv(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_csv(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                  if_changed: bool = False, **kwargs):
         with io.StringIO() as buff:
             df.to_csv(buff, **kwargs)
-            self.blob_service.create_blob_from_text(container_name=self.container_name,
-                                                    blob_name=self._get_bucket_path(filename, folder),
-                                                    text=buff.getvalue())
+            path = self._get_bucket_path(filename, folder)
+            self._upload_buffer(buff, path, if_changed=if_changed, content_settings=self._text_content_settings(path))
 
-    def write_excel(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_excel(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                    if_changed: bool = False, **kwargs):
         with io.BytesIO() as buff:
             df.to_excel(buff, **kwargs)
-            self.blob_service.create_blob_from_bytes(container_name=self.container_name,
-                                                     blob_name=self._get_bucket_path(filename, folder),
-                                                     blob=buff.getvalue())
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
 
-    def write_parquet(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_parquet(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                      if_changed: bool = False, **kwargs):
         with io.BytesIO() as buff:
             df.to_parquet(buff, **kwargs)
-            self.blob_service.create_blob_from_bytes(container_name=self.container_name,
-                                                     blob_name=self._get_bucket_path(filename, folder),
-                                                     blob=buff.getvalue())
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
 
-    def write_yaml(self, data: dict, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_yaml(self, data: dict, filename: str, folder: Union[str, None] = None,
+                   if_changed: bool = False, **kwargs):
         with io.StringIO() as buff:
             yaml.dump(data, buff, **kwargs)
-            self.blob_service.create_blob_from_text(container_name=self.container_name,
-                                                    blob_name=self._get_bucket_path(filename, folder),
-                                                    text=buff.getvalue())
+            path = self._get_bucket_path(filename, folder)
+            self._upload_buffer(buff, path, if_changed=if_changed, content_settings=self._text_content_settings(path))
 
-    def write_json(self, data: dict, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_json(self, data: dict, filename: str, folder: Union[str, None] = None,
+                   if_changed: bool = False, **kwargs):
         with io.StringIO() as buff:
             json.dump(data, buff, **kwargs)
-            self.blob_service.create_blob_from_text(container_name=self.container_name,
-                                                    blob_name=self._get_bucket_path(filename, folder),
-                                                    text=buff.getvalue())
+            path = self._get_bucket_path(filename, folder)
+            self._upload_buffer(buff, path, if_changed=if_changed, content_settings=self._text_content_settings(path))
 
-    def write_object(self, write_object, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_object(self, write_object, filename: str, folder: Union[str, None] = None,
+                     if_changed: bool = False, **kwargs):
         if isinstance(write_object, bytes):
-            self.blob_service.create_blob_from_bytes(container_name=self.container_name,
-                                                     blob_name=self._get_bucket_path(filename, folder),
-                                                     blob=write_object)
+            self._upload_buffer(io.BytesIO(write_object), self._get_bucket_path(filename, folder),
+                                if_changed=if_changed)
         elif isinstance(write_object, io.BytesIO):
-            self.blob_service.create_blob_from_bytes(container_name=self.container_name,
-                                                     blob_name=self._get_bucket_path(filename, folder),
-                                                     blob=write_object.getvalue())
+            self._upload_buffer(write_object, self._get_bucket_path(filename, folder), if_changed=if_changed)
         else:
-            self.blob_service.create_blob_from_stream(container_name=self.container_name,
-                                                      blob_name=self._get_bucket_path(filename, folder),
-                                                      stream=write_object)
-
-    def write_object_from_file(self, object_filename: str, filename: str, folder: Union[str, None] = None, **kwargs):
-        self.blob_service.create_blob_from_path(container_name=self.container_name,
-                                                blob_name=self._get_bucket_path(filename, folder),
-                                                file_path=object_filename, **kwargs)
+            self._upload_stream(write_object, self._get_bucket_path(filename, folder), if_changed=if_changed,
+                                **kwargs)
+
+    def write_object_from_file(self, object_filename: str, filename: str, folder: Union[str, None] = None,
+                               if_changed: bool = False, resumable: bool = False,
+                               checkpoint_dir: Union[str, None] = None, verify: bool = False, **kwargs):
+        if verify:
+            # The service checks the MD5 of every block (or of the whole Put Blob) sent with it
+            kwargs.setdefault('validate_content', True)
+        if resumable:
+            bucket_path = self._get_bucket_path(filename, folder)
+            if not (if_changed and self._skip_unchanged_file(object_filename, bucket_path)):
+                self._write_resumable(object_filename, bucket_path, checkpoint_dir, **kwargs)
+            return
+        with open(object_filename, 'rb') as f:
+            self._upload_stream(f, self._get_bucket_path(filename, folder), if_changed=if_changed, **kwargs)
@@ -0,0 +1,8 @@
+import logging
+
+__core_logger = logging.getLogger('core')
+__core_logger.setLevel(logging.INFO)
+
+__all__ = [
+    'storages',
+]
@@ -0,0 +1,269 @@
+import io
+import threading
+from collections import OrderedDict
+
+
+class MemoryViewReader(io.RawIOBase):
+    # Seekable, read-only file object over any buffer (bytes, bytearray, mmap) that does not copy it
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        end = min(self._position + len(b), len(self._view))
+        size = max(end - self._position, 0)
+        b[:size] = self._view[self._position:end]
+        self._position += size
+        return size
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(self._position + size, len(self._view))
+        data = self._view[self._position:end].tobytes()
+        self._position = max(end, self._position)
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = len(self._view) + offset
+        else:
+            raise ValueError(f'Invalid whence ({whence})')
+        if self._position < 0:
+            raise ValueError('Negative seek position')
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def getbuffer(self) -> memoryview:
+        return self._view
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+class RangedReader(io.RawIOBase):
+    # Sequential, non-seekable stream over an object fetched in chunks through ranged reads
+
+    def __init__(self, read_range, size: int, chunk_size: int = 8 * 1024 * 1024):
+        self._read_range = read_range
+        self._size = size
+        self._chunk_size = chunk_size
+        self._chunk = memoryview(b'')
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if not self._chunk:
+            if self._position >= self._size:
+                return 0
+            end = min(self._position + self._chunk_size, self._size)
+            self._chunk = memoryview(self._read_range(self._position, end))
+        size = min(len(b), len(self._chunk))
+        b[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        self._position += size
+        return size
+
+    def tell(self) -> int:
+        return self._position
+
+
+class StreamReader(io.RawIOBase):
+    # Raw IO over any object with read(size), so it can be buffered and read line by line
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        data = self._stream.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+class IterableReader(io.RawIOBase):
+    # Non-seekable stream over an iterable of bytes chunks, producing them only when they are read
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._chunk:
+            try:
+                self._chunk = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self._chunk))
+        b[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+class RangedFile(io.RawIOBase):
+    # Seekable, read-only file over an object, every read is a ranged GET of the bytes asked for
+
+    def __init__(self, read_range, size: int):
+        self._read_range = read_range
+        self._size = size
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        end = min(self._position + len(b), self._size)
+        if end <= self._position:
+            return 0
+        data = self._read_range(self._position, end)
+        b[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f'Invalid whence ({whence})')
+        if position < 0:
+            raise ValueError('Negative seek position')
+        self._position = position
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def size(self) -> int:
+        return self._size
+
+
+class CachedRangedFile(RangedFile):
+    # RangedFile keeping the last cache_blocks blocks. Reads continuing where the previous one ended grow a
+    # read-ahead window up to max_read_ahead bytes, a seek elsewhere shrinks it back to one block. The missing
+    # blocks of a read are fetched with a single ranged GET
+
+    def __init__(self, read_range, size: int, block_size: int, max_read_ahead: int, cache_blocks: int = 32):
+        RangedFile.__init__(self, read_range, size)
+        self._block_size = block_size
+        self._max_read_ahead = max(max_read_ahead, block_size)
+        self._read_ahead = block_size
+        self._last_end = None
+        # The cache always holds a whole read-ahead window
+        self._cache_blocks = max(cache_blocks, 2 * self._max_read_ahead // block_size)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def _fetch(self, first: int, last: int) -> dict:
+        blocks = {}
+        block = first
+        while block <= last:
+            if block in self._cache:
+                self._cache.move_to_end(block)
+                blocks[block] = self._cache[block]
+                block += 1
+                continue
+            run_end = block
+            while run_end + 1 <= last and run_end + 1 not in self._cache:
+                run_end += 1
+            start, end = block * self._block_size, min((run_end + 1) * self._block_size, self._size)
+            data = self._read_range(start, end)
+            if len(data) != end - start:
+                raise IOError(f'Expected {end - start} bytes from offset {start}, got {len(data)}')
+            self.requests += 1
+            for index in range(block, run_end + 1):
+                offset = (index - block) * self._block_size
+                blocks[index] = self._cache[index] = data[offset:offset + self._block_size]
+            block = run_end + 1
+
+        while len(self._cache) > self._cache_blocks:
+            self._cache.popitem(last=False)
+        return blocks
+
+    def readinto(self, b) -> int:
+        with self._lock:
+            start = self._position
+            end = min(start + len(b), self._size)
+            if end <= start:
+                return 0
+
+            if start == self._last_end:
+                self._read_ahead = min(self._read_ahead * 2, self._max_read_ahead)
+                ahead_end = min(end + self._read_ahead, self._size)
+                # The window is refilled once half of it has been read, not a block at a time
+                if (min(end + self._read_ahead // 2, self._size) - 1) // self._block_size in self._cache:
+                    ahead_end = end
+            else:
+                self._read_ahead = self._block_size
+                ahead_end = end
+            self._last_end = end
+
+            first, last = start // self._block_size, (end - 1) // self._block_size
+            blocks = self._fetch(first, (ahead_end - 1) // self._block_size)
+            view = memoryview(b).cast('B')
+            written = 0
+            for index in range(first, last + 1):
+                block_start = index * self._block_size
+                chunk = blocks[index][max(start - block_start, 0):end - block_start]
+                view[written:written + len(chunk)] = chunk
+                written += len(chunk)
+            self._position = end
+            return written
+
+
+class ChunkSink(io.RawIOBase):
+    # Write-only file that hands over what was written with drain(), tell() keeps counting across drains
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
@@ -0,0 +1,44 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from typing import Union
+
+
+def checkpoint_path(local_path: str, remote_path: str, checkpoint_dir: Union[str, None] = None) -> str:
+    digest = hashlib.sha1(remote_path.encode()).hexdigest()[:12]
+    folder = os.path.dirname(os.path.abspath(local_path)) if checkpoint_dir is None else checkpoint_dir
+    return os.path.join(folder, f'.{os.path.basename(local_path)}.{digest}.caelus-checkpoint')
+
+
+class Checkpoint(object):
+
+    def __init__(self, path: str, key: Union[dict, None]):
+        # key identifies the transfer (object, size, version...). The state saved for another key is kept in stale
+        # so what it left behind can be cleaned up, None accepts any saved state
+        self.path = path
+        self.key = key
+        self.state = {}
+        self.stale = None
+        self._lock = threading.Lock()
+
+        if os.path.isfile(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if key is None or saved['key'] == key:
+                self.state = saved['state']
+            else:
+                self.stale = saved['state']
+
+    def save(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f'{self.path}.{uuid.uuid4().hex}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'key': self.key, 'state': self.state}, f)
+            os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
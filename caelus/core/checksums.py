@@ -0,0 +1,185 @@
+import base64
+import binascii
+import hashlib
+import io
+from typing import Union
+
+try:
+    import google_crc32c
+except ImportError:
+    # Installed with google-cloud-storage, CRC32C is only computed when it is available
+    google_crc32c = None
+
+
+class ChecksumError(IOError):
+    pass
+
+
+def b64_to_hex(b64_digest: Union[None, str]) -> Union[None, str]:
+    # Azure Content-MD5 and GCS md5Hash are base64 encoded, S3 ETags are hex
+    if not b64_digest:
+        return None
+    try:
+        return base64.b64decode(b64_digest).hex()
+    except (binascii.Error, ValueError):
+        return None
+
+
+class HashingReader(io.RawIOBase):
+    # Wraps a readable stream and hashes every byte that goes through it
+
+    def __init__(self, stream, algorithm: str = 'md5'):
+        self._stream = stream
+        self._hash = hashlib.new(algorithm)
+        self._bytes_read = 0
+
+    @property
+    def bytes_read(self) -> int:
+        return self._bytes_read
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read() if size is None or size < 0 else self._stream.read(size)
+        self._hash.update(data)
+        self._bytes_read += len(data)
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def tell(self) -> int:
+        return self._bytes_read
+
+
+def part_digests(fileobj, part_size: int):
+    full_hash = hashlib.md5()
+    parts = []
+    if isinstance(fileobj, io.BytesIO):
+        with fileobj.getbuffer() as view:
+            for start in range(fileobj.tell(), len(view), part_size):
+                part = view[start:start + part_size]
+                full_hash.update(part)
+                parts.append(hashlib.md5(part).digest())
+                part.release()
+    else:
+        for part in iter(lambda: fileobj.read(part_size), b''):
+            full_hash.update(part)
+            parts.append(hashlib.md5(part).digest())
+    return full_hash.hexdigest(), parts
+
+
+def s3_multipart_etag(parts: list) -> str:
+    return f'{hashlib.md5(b"".join(parts)).hexdigest()}-{len(parts)}'
+
+
+def hex_to_b64(hex_digest: str) -> str:
+    return base64.b64encode(bytes.fromhex(hex_digest)).decode()
+
+
+class StreamingDigest(object):
+    # MD5 (and CRC32C when available) of a payload updated as it streams through a transfer. With part_size, the
+    # MD5 of every part is kept too, to compare with S3 multipart ETags
+
+    def __init__(self, part_size: Union[int, None] = None, crc32c: bool = True):
+        self._md5 = hashlib.md5()
+        self._crc32c = google_crc32c.Checksum() if crc32c and google_crc32c is not None else None
+        self._part_size = part_size
+        self._part_md5 = hashlib.md5()
+        self._part_filled = 0
+        self._part_digests = []
+        self.size = 0
+
+    def update(self, data):
+        # hashlib and google-crc32c release the GIL on big buffers and use the CPU CRC32 instructions
+        view = memoryview(data).cast('B')
+        self._md5.update(view)
+        if self._crc32c is not None:
+            # It only takes read-only buffers
+            self._crc32c.update(data if isinstance(data, bytes) else bytes(view))
+        self.size += len(view)
+        if self._part_size is None:
+            return
+        while len(view):
+            taken = view[:self._part_size - self._part_filled]
+            self._part_md5.update(taken)
+            self._part_filled += len(taken)
+            view = view[len(taken):]
+            if self._part_filled == self._part_size:
+                self._part_digests.append(self._part_md5.digest())
+                self._part_md5, self._part_filled = hashlib.md5(), 0
+
+    @property
+    def md5(self) -> str:
+        return self._md5.hexdigest()
+
+    @property
+    def crc32c(self) -> Union[str, None]:
+        return None if self._crc32c is None else base64.b64encode(self._crc32c.digest()).decode()
+
+    def multipart_etag(self) -> str:
+        parts = self._part_digests + ([self._part_md5.digest()] if self._part_filled else [])
+        return s3_multipart_etag(parts)
+
+
+
+def file_digest(path: str, part_size: Union[int, None] = None, read_size: int = 8 * 1024 * 1024) -> StreamingDigest:
+    digest = StreamingDigest(part_size)
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(read_size), b''):
+            digest.update(data)
+    return digest
+
+class DigestReader(io.RawIOBase):
+    # Non-seekable reader updating a StreamingDigest, SDKs reading from it go through the payload in order
+
+    def __init__(self, stream, digest: StreamingDigest):
+        self._stream = stream
+        self._digest = digest
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read() if size is None or size < 0 else self._stream.read(size)
+        self._digest.update(data)
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def tell(self) -> int:
+        return self._digest.size
+
+
+class DigestWriter(io.RawIOBase):
+    # Non-seekable writer updating a StreamingDigest, SDKs writing to it deliver the payload in order
+
+    def __init__(self, stream, digest: StreamingDigest):
+        self._stream = stream
+        self._digest = digest
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._digest.update(b)
+        self._stream.write(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._digest.size
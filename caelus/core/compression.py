@@ -0,0 +1,48 @@
+import bz2
+import gzip
+import lzma
+import zlib
+from typing import Union
+
+EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}
+
+
+def infer_compression(path: str, compression: Union[str, None]) -> Union[str, None]:
+    if compression != 'infer':
+        return compression
+    return next((name for extension, name in EXTENSIONS.items() if path.endswith(extension)), None)
+
+
+def decompressing_reader(fileobj, compression: Union[str, None]):
+    if compression is None:
+        return fileobj
+    elif compression == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    elif compression == 'bz2':
+        return bz2.BZ2File(fileobj, mode='rb')
+    elif compression == 'xz':
+        return lzma.LZMAFile(fileobj, mode='rb')
+    raise ValueError(f'Unknown compression {compression}, use one of {", ".join(EXTENSIONS.values())}')
+
+
+def _compressor(compression: Union[str, None]):
+    if compression == 'gzip':
+        return zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    elif compression == 'bz2':
+        return bz2.BZ2Compressor()
+    elif compression == 'xz':
+        return lzma.LZMACompressor(format=lzma.FORMAT_XZ)
+    raise ValueError(f'Unknown compression {compression}, use one of {", ".join(EXTENSIONS.values())}')
+
+
+def compress_chunks(chunks, compression: Union[str, None]):
+    if compression is None:
+        yield from chunks
+        return
+
+    compressor = _compressor(compression)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Union
+
+
+class HedgePolicy(object):
+    # Sends a duplicate of a read that is slower than the percentile of the recent latencies, the first answer wins.
+    # Only for idempotent requests, the slower copy still completes and its result is dropped
+    _core_logger = logging.getLogger('core')
+
+    def __init__(self, percentile: float = 95, budget: float = 0.05, window: int = 500, min_samples: int = 50,
+                 min_delay: float = 0.01, max_workers: int = 32):
+        # budget is the share of requests that may be hedged, counted over the requests of the instance, which can
+        # be shared by several storages. Nothing is hedged before min_samples latencies are known
+        self.percentile = percentile
+        self.budget = budget
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_workers = max_workers
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = os.getpid()
+
+    def __reduce__(self):
+        return self.__class__, (self.percentile, self.budget, self.window, self.min_samples, self.min_delay,
+                                self.max_workers)
+
+    def _check_process(self):
+        # A forked child can not use the threads of the parent nor a lock they held, it starts with new ones
+        if self._pid != os.getpid():
+            self._lock, self._executor, self._pid = threading.Lock(), None, os.getpid()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        self._check_process()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hedge')
+            return self._executor
+
+    def delay(self) -> Union[float, None]:
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        index = min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)
+        return max(latencies[index], self.min_delay)
+
+    def _record(self, started: float, future):
+        if future.exception() is None:
+            with self._lock:
+                self._latencies.append(time.perf_counter() - started)
+
+    def _submit(self, fn, *args):
+        started = time.perf_counter()
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda done: self._record(started, done))
+        return future
+
+    def _take_hedge(self) -> bool:
+        with self._lock:
+            if self.hedged >= self.budget * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def call(self, fn, *args):
+        self._check_process()
+        with self._lock:
+            self.requests += 1
+        delay = self.delay()
+        primary = self._submit(fn, *args)
+        if delay is None:
+            return primary.result()
+
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_hedge():
+            return primary.result()
+
+        self._core_logger.debug(f'Hedging a request slower than {delay:.3f}s')
+        hedge = self._submit(fn, *args)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def shutdown(self):
+        self._check_process()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,138 @@
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import yaml
+
+from caelus.core.buffers import MemoryViewReader
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python 3.7, results are sent back as Arrow IPC bytes
+    shared_memory = None
+
+
+def _read_yaml(buff, yaml_loader=yaml.FullLoader):
+    return yaml.load(buff, Loader=yaml_loader)
+
+
+def _read_bytes(buff, **kwargs):
+    return buff.read(**kwargs)
+
+
+# Reader name -> parser of a binary file object, with the same kwargs as the matching read_* method
+PARSERS = {
+    'csv': pd.read_csv,
+    'excel': pd.read_excel,
+    'parquet': pd.read_parquet,
+    'json': json.load,
+    'yaml': _read_yaml,
+    'bytes': _read_bytes,
+}
+
+
+def parse(reader: str, buff, **kwargs):
+    try:
+        parser = PARSERS[reader]
+    except KeyError:
+        raise ValueError(f'Unknown reader {reader}, use one of {", ".join(PARSERS)}') from None
+    return parser(buff, **kwargs)
+
+
+def table_to_ipc(table: pa.Table) -> pa.Buffer:
+    sink = pa.BufferOutputStream()
+    writer = pa.RecordBatchStreamWriter(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    return sink.getvalue()
+
+
+def ipc_to_table(data) -> pa.Table:
+    return pa.ipc.open_stream(data).read_all()
+
+
+def csv_to_ipc(data: bytes, **kwargs) -> bytes:
+    # Runs in worker processes, Arrow IPC is cheaper to send back than a pickled DataFrame
+    return table_to_ipc(pa_csv.read_csv(pa.BufferReader(data), **kwargs)).to_pybytes()
+
+
+def _to_shared_memory(data) -> tuple:
+    size = len(data)
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    block.buf[:size] = memoryview(data).cast('B')
+    block.close()
+    return block.name, size
+
+
+def _parse_in_worker(reader: str, payload, kwargs: dict):
+    # payload is (shared memory name, size), or the bytes themselves without shared memory
+    if isinstance(payload, tuple):
+        block = shared_memory.SharedMemory(name=payload[0])
+        try:
+            with MemoryViewReader(block.buf[:payload[1]]) as buff:
+                value = parse(reader, buff, **kwargs)
+        finally:
+            block.close()
+    else:
+        value = parse(reader, io.BytesIO(payload), **kwargs)
+
+    if not isinstance(value, pd.DataFrame):
+        return 'object', value
+    try:
+        ipc = table_to_ipc(pa.Table.from_pandas(value))
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Mixed object columns can not be converted to Arrow, they are pickled
+        return 'object', value
+    if shared_memory is None:
+        return 'ipc', ipc.to_pybytes()
+    return 'shared', _to_shared_memory(ipc)
+
+
+class ParserPool(object):
+
+    def __init__(self, processes: Union[int, None] = None):
+        self.processes = processes
+        self.executor = ProcessPoolExecutor(max_workers=processes)
+
+    def parse(self, reader: str, data, **kwargs):
+        payload = bytes(data) if shared_memory is None else _to_shared_memory(data)
+        try:
+            kind, result = self.executor.submit(_parse_in_worker, reader, payload, kwargs).result()
+        finally:
+            if shared_memory is not None:
+                self._unlink(payload[0])
+
+        if kind == 'object':
+            return result
+        elif kind == 'ipc':
+            return ipc_to_table(result).to_pandas()
+
+        name, size = result
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            # A single memcpy out of the block, DataFrames built over it would outlive the mapping
+            data = block.buf[:size].tobytes()
+        finally:
+            block.close()
+            block.unlink()
+        return ipc_to_table(data).to_pandas()
+
+    @staticmethod
+    def _unlink(name: str):
+        block = shared_memory.SharedMemory(name=name)
+        block.close()
+        block.unlink()
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
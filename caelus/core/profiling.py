@@ -0,0 +1,87 @@
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+NETWORK = 'network'
+SERIALIZATION = 'serialization'
+QUEUE = 'queue'
+
+
+class Profiler(object):
+    # Timeline of spans saved as Chrome trace events, the file opens in Perfetto (ui.perfetto.dev) or chrome://tracing
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._events = []
+        self._threads = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _timestamp(self, instant: float) -> float:
+        return (instant - self._origin) * 1e6
+
+    def _append(self, event: dict):
+        thread = threading.current_thread()
+        with self._lock:
+            self._threads[thread.ident] = thread.name
+            self._events.append(event)
+
+    def add(self, name: str, category: str, start: float, end: float, **args):
+        # start and end are time.perf_counter() instants of the calling thread
+        self._append({'name': name, 'cat': category, 'ph': 'X', 'ts': self._timestamp(start),
+                      'dur': (end - start) * 1e6, 'pid': self._pid, 'tid': threading.get_ident(), 'args': args})
+
+    def add_async(self, name: str, category: str, start: float, end: float, **args):
+        event_id = next(self._ids)
+        for phase, instant in (('b', start), ('e', end)):
+            self._append({'name': name, 'cat': category, 'ph': phase, 'ts': self._timestamp(instant),
+                          'id': event_id, 'pid': self._pid, 'tid': threading.get_ident(), 'args': args})
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, time.perf_counter(), **args)
+
+    @property
+    def events(self) -> list:
+        with self._lock:
+            threads = [{'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': ident, 'args': {'name': name}}
+                       for ident, name in self._threads.items()]
+            return threads + list(self._events)
+
+    def summary(self) -> dict:
+        totals = {}
+        for event in self.events:
+            if event['ph'] == 'X':
+                totals[event['cat']] = totals.get(event['cat'], 0) + event['dur'] / 1e6
+        return totals
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+class ProfiledExecutor(ThreadPoolExecutor):
+    # Records how long every task waited for a free worker
+
+    def __init__(self, profiler: Profiler, name: str, max_workers: int):
+        ThreadPoolExecutor.__init__(self, max_workers=max_workers, thread_name_prefix=name)
+        self._profiler = profiler
+        self._name = name
+
+    def submit(self, fn, *args, **kwargs):
+        queued = time.perf_counter()
+
+        def task():
+            self._profiler.add_async(f'{self._name} queued', QUEUE, queued, time.perf_counter())
+            return fn(*args, **kwargs)
+
+        return ThreadPoolExecutor.submit(self, task)
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+import pyarrow as pa
+
+from caelus.core.transfers import MB
+
+
+class ResultCache(object):
+    # DataFrames parsed from objects, stored as Arrow IPC files in cache_dir and memory-mapped back. Entries are
+    # keyed by object version and reader arguments, so a rewritten object or other arguments are parsed again
+    _core_logger = logging.getLogger('core')
+
+    READERS = ('csv', 'excel')
+
+    def __init__(self, cache_dir: str, max_size: int = 4096 * MB, max_age: Union[timedelta, None] = None):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def __reduce__(self):
+        return self.__class__, (str(self.cache_dir), self.max_size, self.max_age)
+
+    @staticmethod
+    def key(uri: str, etag: str, reader: str, kwargs: dict) -> str:
+        # Arguments that are not JSON (types, functions) are keyed by their repr
+        arguments = json.dumps(kwargs, sort_keys=True, default=repr)
+        return hashlib.sha256('\n'.join((uri, etag, reader, arguments)).encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}.arrow'
+
+    def _expired(self, stat: os.stat_result) -> bool:
+        # The modification time is when the entry was written, the access time when it was last read
+        return self.max_age is not None and time.time() - stat.st_mtime > self.max_age.total_seconds()
+
+    def get(self, key: str) -> Union[pd.DataFrame, None]:
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if self._expired(stat):
+            self._remove(path)
+            return None
+
+        try:
+            with pa.memory_map(str(path)) as source:
+                table = pa.ipc.open_file(source).read_all()
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            # Evicted by another thread or process since the stat
+            return None
+        return table.to_pandas()
+
+    def put(self, key: str, value) -> bool:
+        if not isinstance(value, pd.DataFrame):
+            return False
+        try:
+            table = pa.Table.from_pandas(value)
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            self._core_logger.debug(f'Result not cached, Arrow can not store it: {e}')
+            return False
+
+        path = self._path(key)
+        tmp_path = path.with_name(f'{path.name}.{uuid.uuid4().hex}.tmp')
+        with pa.OSFile(str(tmp_path), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        self.evict()
+        return True
+
+    def _remove(self, path: Path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for path in self.cache_dir.glob('*.arrow'):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if self._expired(stat):
+                    self._remove(path)
+                else:
+                    entries.append((stat.st_atime, stat.st_size, path))
+
+            size = sum(entry_size for _, entry_size, _ in entries)
+            for _, entry_size, path in sorted(entries):
+                if size <= self.max_size:
+                    break
+                self._remove(path)
+                size -= entry_size
+
+    def clear(self):
+        for path in self.cache_dir.glob('*.arrow'):
+            self._remove(path)
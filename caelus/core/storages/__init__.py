@@ -1,6 +1,8 @@
 import logging
-from .storage import Storage
+from .storage import Storage, ObjectStat, ConditionalRead
 
 __all__ = [
     'Storage',
+    'ObjectStat',
+    'ConditionalRead',
 ]
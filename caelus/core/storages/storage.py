@@ -1,14 +1,111 @@
+import io
+import json
+import logging
+import os
+import pickle
+import shutil
+import threading
+import uuid
 from abc import ABC, abstractmethod
+from collections import namedtuple, Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 from typing import Union, Generator
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import yaml
 
+from caelus.core.buffers import RangedReader, MemoryViewReader, StreamReader, IterableReader, RangedFile, \
+    CachedRangedFile, ChunkSink
+from caelus.core.checkpoints import Checkpoint, checkpoint_path
+from caelus.core.checksums import HashingReader, ChecksumError, StreamingDigest, part_digests
+from caelus.core.compression import infer_compression, decompressing_reader, compress_chunks
+from caelus.core.hedging import HedgePolicy
+from caelus.core.results import ResultCache
+from caelus.core.profiling import Profiler, ProfiledExecutor, NETWORK, SERIALIZATION
+from caelus.core.parsers import parse, csv_to_ipc, ipc_to_table, ParserPool
+from caelus.core.throttle import RateLimiter, ThrottledFile
+from caelus.core.writebehind import WriteBehindQueue, WriteBehindError
+from caelus.core.transfers import RangeConfig, ranged_download, MB
+
+ObjectStat = namedtuple('ObjectStat', ['name', 'size', 'etag', 'md5', 'last_modified', 'content_type'])
+ConditionalRead = namedtuple('ConditionalRead', ['modified', 'etag', 'value'])
+
+# Storage of the Storage.map worker processes, unpickled once per worker so its clients serve every task
+_worker_storage = None
+
+
+def _init_map_worker(pickled_storage: bytes):
+    # The storage is sent pickled even to forked workers, so clients, locks and threads are not inherited
+    global _worker_storage
+    _worker_storage = pickle.loads(pickled_storage)
+
+
+def _map_worker(fn, object_name: str):
+    return fn(_worker_storage, object_name)
+
 
 class Storage(ABC):
+    _core_logger = logging.getLogger('core')
+
+    REVALIDATION_CACHE_SIZE = 128
+    DENSE_STAT_MIN = 100
 
     def __init__(self, base_path: str):
         self._base_path = base_path
+        self._range_config = RangeConfig()
+        self._upload_stats = Counter()
+        self._upload_stats_lock = threading.Lock()
+        self._revalidation_cache = OrderedDict()
+        self._revalidation_cache_lock = threading.Lock()
+        self._parser_pool = None
+        self._rate_limiter = None
+        self._profiler = None
+        self._result_cache = None
+        self._hedge_policy = None
+        self._write_queue = None
+        self._clients = {}
+        self._clients_lock = threading.RLock()
+        self._clients_pid = os.getpid()
+
+    def __getstate__(self):
+        # Pickled through the construction parameters and settings, SDK clients, caches and locks belong to a process
+        state = self.__dict__.copy()
+        for attribute in ('_clients', '_clients_lock', '_clients_pid', '_upload_stats_lock', '_revalidation_cache',
+                          '_revalidation_cache_lock', '_parser_pool', '_profiler', '_write_queue'):
+            state.pop(attribute)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._upload_stats_lock = threading.Lock()
+        self._revalidation_cache = OrderedDict()
+        self._revalidation_cache_lock = threading.Lock()
+        self._parser_pool = None
+        self._profiler = None
+        self._write_queue = None
+        self._clients = {}
+        self._clients_lock = threading.RLock()
+        self._clients_pid = os.getpid()
+
+    def _process_clients(self) -> dict:
+        # Clients created by this process, a forked child starts with none instead of sharing the parent's pools
+        if self._clients_pid != os.getpid():
+            self._clients, self._clients_lock, self._clients_pid = {}, threading.RLock(), os.getpid()
+        return self._clients
+
+    def _client(self, name: str, factory):
+        # Reentrant, a factory can build on another client
+        clients = self._process_clients()
+        client = clients.get(name)
+        if client is None:
+            with self._clients_lock:
+                client = clients.get(name)
+                if client is None:
+                    client = clients[name] = factory()
+        return client
 
     @property
     def base_path(self) -> str:
@@ -18,6 +115,104 @@ class Storage(ABC):
     def base_path(self, new_path):
         self._base_path = new_path
 
+    @property
+    def range_config(self) -> RangeConfig:
+        return self._range_config
+
+    @range_config.setter
+    def range_config(self, new_range_config):
+        self._range_config = new_range_config
+
+    @property
+    def parser_pool(self) -> Union[ParserPool, None]:
+        return self._parser_pool
+
+    @parser_pool.setter
+    def parser_pool(self, new_parser_pool: Union[ParserPool, int, None]):
+        self._parser_pool = ParserPool(new_parser_pool) if isinstance(new_parser_pool, int) else new_parser_pool
+
+    @property
+    def result_cache(self) -> Union[ResultCache, None]:
+        return self._result_cache
+
+    @result_cache.setter
+    def result_cache(self, new_result_cache: Union[ResultCache, str, None]):
+        self._result_cache = ResultCache(new_result_cache) if isinstance(new_result_cache, str) \
+            else new_result_cache
+
+    @property
+    def hedge_policy(self) -> Union[HedgePolicy, None]:
+        return self._hedge_policy
+
+    @hedge_policy.setter
+    def hedge_policy(self, new_hedge_policy: Union[HedgePolicy, None]):
+        self._hedge_policy = new_hedge_policy
+
+    @property
+    def rate_limiter(self) -> Union[RateLimiter, None]:
+        return self._rate_limiter
+
+    @rate_limiter.setter
+    def rate_limiter(self, new_rate_limiter: Union[RateLimiter, None]):
+        self._rate_limiter = new_rate_limiter
+
+    def _throttle_bytes(self, size: int):
+        if self._rate_limiter is not None:
+            self._rate_limiter.throttle_bytes(size)
+
+    def _throttle_request(self, *args, **kwargs):
+        if self._rate_limiter is not None:
+            self._rate_limiter.throttle_request()
+
+    def _throttled(self, fileobj):
+        return fileobj if self._rate_limiter is None else ThrottledFile(fileobj, self._rate_limiter)
+
+    def _progress_callback(self):
+        if self._rate_limiter is None:
+            return None
+        transferred = [0]
+        lock = threading.Lock()
+
+        def callback(current, total):
+            with lock:
+                size = current - transferred[0]
+                transferred[0] = max(current, transferred[0])
+            self._throttle_bytes(size)
+
+        return callback
+
+    @contextmanager
+    def profile(self, path: Union[str, None] = None):
+        profiler, previous = Profiler(), self._profiler
+        self._profiler = profiler
+        try:
+            yield profiler
+        finally:
+            self._profiler = previous
+            if path is not None:
+                profiler.save(path)
+
+    def _span(self, name: str, category: str, **args):
+        return nullcontext() if self._profiler is None else self._profiler.span(name, category, **args)
+
+    def _record_request(self, name: str, start: float, end: float, **args):
+        if self._profiler is not None:
+            self._profiler.add(name, NETWORK, start, end, **args)
+
+    def _executor(self, max_workers: int, name: str) -> ThreadPoolExecutor:
+        if self._profiler is None:
+            return ThreadPoolExecutor(max_workers=max_workers)
+        return ProfiledExecutor(self._profiler, name, max_workers=max_workers)
+
+    @property
+    def upload_stats(self) -> dict:
+        with self._upload_stats_lock:
+            return {'uploaded': self._upload_stats['uploaded'], 'skipped': self._upload_stats['skipped']}
+
+    def _record_upload(self, outcome: str):
+        with self._upload_stats_lock:
+            self._upload_stats[outcome] += 1
+
     def _get_folder_path(self, folder: Union[None, str] = None) -> str:
         full_path = self.base_path
         if folder is not None:
@@ -41,6 +236,236 @@ class Storage(ABC):
         filename = "".join(i for i in filename if i not in "\:*?<>|")
         return object_filename_full, filename
 
+    def _object_uri(self, path: str) -> str:
+        return path
+
+    @staticmethod
+    def _object_name(storage_object) -> str:
+        # Listings yield keys (S3, local) or Blob objects (Azure, GCP)
+        return storage_object if isinstance(storage_object, str) else storage_object.name
+
+    ##############
+    # PRIMITIVES #
+    ##############
+
+    @abstractmethod
+    def _stat(self, path: str) -> ObjectStat:
+        # Raises FileNotFoundError when the object does not exist
+        pass
+
+    @abstractmethod
+    def _read_range(self, path: str, start: int, end: int, etag: Union[str, None] = None) -> bytes:
+        # Bytes in [start, end), failing if the object no longer matches etag
+        pass
+
+    def _list_stats(self, prefix: str) -> Union[Generator, None]:
+        # ObjectStats of the objects under prefix, None when the listing does not cost less than HEAD requests
+        return None
+
+    def _stat_or_none(self, path: str) -> Union[ObjectStat, None]:
+        try:
+            return self._stat(path)
+        except FileNotFoundError:
+            return None
+
+    def _stat_paths(self, paths: list, max_workers: int) -> list:
+        with self._executor(max_workers, 'stat') as executor:
+            return list(executor.map(self._stat_or_none, paths))
+
+    def _read_first_range(self, path: str, end: int):
+        # Backends that get the object properties along with a ranged GET override this to save the HEAD
+        stat = self._stat(path)
+        return self._read_range(path, 0, min(end, stat.size), stat.etag), stat
+
+    def _read_first_range_throttled(self, path: str, end: int):
+        if self._hedge_policy is None:
+            data, stat = self._read_first_range(path, end)
+        else:
+            data, stat = self._hedge_policy.call(self._read_first_range, path, end)
+        self._throttle_bytes(len(data))
+        return data, stat
+
+    def _read_range_throttled(self, path: str, start: int, end: int, etag: Union[str, None] = None) -> bytes:
+        data = self._read_range(path, start, end, etag)
+        self._throttle_bytes(len(data))
+        return data
+
+    def _download_to_memory(self, path: str):
+        with self._span('download', NETWORK, path=path):
+            return ranged_download(lambda end: self._read_first_range_throttled(path, end),
+                                   lambda start, end, etag: self._read_range_throttled(path, start, end, etag),
+                                   self.range_config, lambda max_workers: self._executor(max_workers, 'range'))
+
+    def _download_version(self, path: str, stat: ObjectStat):
+        # Like _download_to_memory, failing if the object is no longer the version of stat
+        with self._span('download', NETWORK, path=path):
+            return ranged_download(lambda end: (self._read_range_throttled(path, 0, min(end, stat.size), stat.etag),
+                                                stat),
+                                   lambda start, end, etag: self._read_range_throttled(path, start, end, etag),
+                                   self.range_config, lambda max_workers: self._executor(max_workers, 'range'))
+
+    def _read_if_none_match(self, path: str, etag: Union[str, None]):
+        # (None, stat) when the object still matches etag, (bytes, stat) otherwise. Compares the metadata and reads
+        # the matching version, backends with conditional GETs override it to do both in a single request
+        stat = self._stat(path)
+        if etag is not None and stat.etag == etag:
+            return None, stat
+        return self._read_range_throttled(path, 0, stat.size, stat.etag), stat
+
+    @contextmanager
+    def _open_stream(self, path: str):
+        stat = self._stat(path)
+        with RangedReader(lambda start, end: self._read_range(path, start, end, stat.etag), stat.size,
+                          self.range_config.part_size) as stream:
+            yield stream
+
+    @contextmanager
+    def _arrow_buffer(self, path: str):
+        with pa.BufferReader(self._download_to_memory(path)) as source:
+            yield source
+
+    @contextmanager
+    def _arrow_ranged(self, path: str):
+        stat = self._stat(path)
+        with pa.PythonFile(RangedFile(lambda start, end: self._read_range_throttled(path, start, end, stat.etag),
+                                      stat.size), mode='r') as source:
+            yield source
+
+    def _cache_locally(self, path: str, cache_dir: str) -> Path:
+        stat = self._stat(path)
+        cached_path = Path(cache_dir) / path
+        etag_path = cached_path.with_name(f'{cached_path.name}.etag')
+        if cached_path.is_file() and etag_path.is_file() and etag_path.read_text() == stat.etag:
+            return cached_path
+
+        cached_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cached_path.with_name(f'{cached_path.name}.{uuid.uuid4().hex}.tmp')
+        try:
+            with open(tmp_path, 'wb') as f:
+                with self._open_stream(path) as stream:
+                    shutil.copyfileobj(self._throttled(stream), f, self.range_config.part_size)
+            # Readers holding a memory map of the previous version keep it until they close it
+            os.replace(tmp_path, cached_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        etag_path.write_text(stat.etag)
+        self._core_logger.debug(f'{path} cached in {cached_path}')
+        return cached_path
+
+    @abstractmethod
+    def _upload_fileobj(self, fileobj, path: str, **kwargs):
+        pass
+
+    def _resumable_upload(self, local_path: str, path: str, checkpoint: Checkpoint, **kwargs):
+        # Backends with multipart, block or resumable session uploads keep their progress in checkpoint.state
+        with open(local_path, 'rb') as f:
+            self._upload_fileobj(f, path, **kwargs)
+
+    def _abort_resumable_upload(self, path: str, state: dict):
+        pass
+
+    def _resumable_part_size(self) -> Union[int, None]:
+        # Size of the parts saved in the checkpoint, None when the service keeps the upload progress in bytes
+        return None
+
+    def _verify_digest(self, path: str, digest: StreamingDigest, md5: Union[str, None] = None,
+                       crc32c: Union[str, None] = None, multipart_etag: Union[str, None] = None):
+        # Compares the checksum of the bytes that went through a transfer with the one stored by the service
+        if crc32c is not None and digest.crc32c is not None:
+            name, stored, transferred = 'crc32c', crc32c, digest.crc32c
+        elif md5 is not None:
+            name, stored, transferred = 'md5', md5, digest.md5
+        elif multipart_etag is not None:
+            name, stored, transferred = 'multipart etag', multipart_etag, digest.multipart_etag()
+        else:
+            self._core_logger.warning(f'{path}: no stored checksum, the transfer could not be verified')
+            return
+        if stored != transferred:
+            raise ChecksumError(f'{path}: transferred {name} {transferred} does not match the stored {name} {stored}')
+        self._core_logger.debug(f'{path}: {name} verified')
+
+    def _checksum_matches(self, stat: ObjectStat, fileobj) -> bool:
+        return stat.md5 is not None and stat.md5 == part_digests(fileobj, self.range_config.part_size)[0]
+
+    @staticmethod
+    def _remaining_size(fileobj) -> Union[int, None]:
+        if not getattr(fileobj, 'seekable', lambda: False)():
+            return None
+        position = fileobj.tell()
+        size = fileobj.seek(0, io.SEEK_END) - position
+        fileobj.seek(position)
+        return size
+
+    def _skip_unchanged(self, fileobj, path: str) -> bool:
+        position = fileobj.tell()
+        size = self._remaining_size(fileobj)
+        try:
+            stat = self._stat(path)
+        except FileNotFoundError:
+            return False
+
+        try:
+            unchanged = stat.size == size and self._checksum_matches(stat, fileobj)
+        finally:
+            fileobj.seek(position)
+
+        if unchanged:
+            self._core_logger.debug(f'{path} unchanged, skipping upload')
+            self._record_upload('skipped')
+        return unchanged
+
+    def _skip_unchanged_file(self, local_path: str, path: str) -> bool:
+        with open(local_path, 'rb') as f:
+            return self._skip_unchanged(f, path)
+
+    def _upload_stream(self, fileobj, path: str, if_changed: bool = False, **kwargs):
+        if if_changed:
+            if self._remaining_size(fileobj) is None:
+                # Non seekable streams have to be held in memory to be hashed before the upload
+                fileobj = io.BytesIO(fileobj.read())
+            if self._skip_unchanged(fileobj, path):
+                return
+        self._upload_fileobj(fileobj, path, **kwargs)
+        self._record_upload('uploaded')
+
+    def _upload_buffer(self, buff: Union[io.BytesIO, io.StringIO], path: str, if_changed: bool = False, **kwargs):
+        if isinstance(buff, io.StringIO):
+            buff = io.BytesIO(buff.getvalue().encode())
+        if self._write_queue is not None:
+            # Writers close their buffer once this returns, the queued upload gets its own copy
+            data = buff.getvalue()
+            self._write_queue.submit(path, lambda: self._upload_stream(io.BytesIO(data), path, if_changed=if_changed,
+                                                                       **kwargs))
+            return
+        buff.seek(0)
+        self._upload_stream(buff, path, if_changed=if_changed, **kwargs)
+
+    @contextmanager
+    def write_behind(self, max_workers: int = 4, max_pending: int = 16):
+        # Inside the block, the writers serializing in memory (write_csv, write_parquet, write_json...) return once
+        # the payload is queued and upload it in max_workers threads. Writing blocks while max_pending uploads are
+        # waiting, uploads to the same object keep their order. Reads may not see the queued writes before flush.
+        # Leaving the block waits for every upload and raises WriteBehindError if any failed
+        queue, previous = WriteBehindQueue(max_workers=max_workers, max_pending=max_pending), self._write_queue
+        self._write_queue = queue
+        try:
+            yield self
+        except BaseException:
+            self._write_queue = previous
+            try:
+                queue.close()
+            except WriteBehindError:
+                # Already logged, the error of the block is the one raised
+                pass
+            raise
+        self._write_queue = previous
+        queue.close()
+
+    def flush(self):
+        if self._write_queue is not None:
+            self._write_queue.flush()
+
     ################
     # OBJECT ADMIN #
     ################
@@ -55,10 +480,178 @@ class Storage(ABC):
                     dest_object_name: Union[str, None] = None, remove_copied: bool = False):
         pass
 
+    def stat(self, filename: str, folder: Union[str, None] = None) -> ObjectStat:
+        return self._stat(self._get_full_path(filename, folder))
+
+    def exists(self, filename: str, folder: Union[str, None] = None) -> bool:
+        return self._stat_or_none(self._get_full_path(filename, folder)) is not None
+
+    def _stat_listed(self, paths: list, dense_ratio: int) -> Union[list, None]:
+        listing = self._list_stats(os.path.commonprefix(paths))
+        if listing is None:
+            return None
+        wanted = set(paths)
+        found = {}
+        for count, stat in enumerate(listing):
+            if count >= dense_ratio * len(paths):
+                return None
+            if stat.name in wanted:
+                found[stat.name] = stat
+        return [found.get(path) for path in paths]
+
+    def stat_many(self, files: Union[list, Generator], folder: Union[str, None] = None, max_workers: int = 16,
+                  dense_ratio: int = 4) -> dict:
+        # {filename: ObjectStat or None}. Concurrent metadata requests, or a single prefix listing when the keys
+        # are dense enough under their common prefix
+        filenames = list(files)
+        paths = [self._get_full_path(filename, folder) for filename in filenames]
+        stats = self._stat_listed(paths, dense_ratio) if len(paths) >= self.DENSE_STAT_MIN else None
+        if stats is None:
+            stats = self._stat_paths(paths, max_workers)
+        return dict(zip(filenames, stats))
+
+    def exists_many(self, files: Union[list, Generator], folder: Union[str, None] = None, max_workers: int = 16,
+                    dense_ratio: int = 4) -> dict:
+        return {filename: stat is not None
+                for filename, stat in self.stat_many(files, folder, max_workers, dense_ratio).items()}
+
+    #######################
+    # RESUMABLE TRANSFERS #
+    #######################
+
+    def _write_resumable(self, local_path: str, path: str, checkpoint_dir: Union[str, None] = None, **kwargs):
+        file_stat = os.stat(local_path)
+        checkpoint = Checkpoint(checkpoint_path(local_path, path, checkpoint_dir),
+                                {'upload': path, 'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns,
+                                 'part_size': self._resumable_part_size()})
+        if checkpoint.stale is not None:
+            # The local file or the part size changed since the interrupted upload, its parts are useless
+            self._core_logger.info(f'Discarding the interrupted upload of {local_path} to {path}')
+            self._abort_resumable_upload(path, checkpoint.stale)
+        elif checkpoint.state:
+            self._core_logger.info(f'Resuming the upload of {local_path} to {path}')
+
+        self._resumable_upload(local_path, path, checkpoint, **kwargs)
+        checkpoint.remove()
+        self._record_upload('uploaded')
+
+    def _read_resumable(self, path: str, local_path: str, checkpoint_dir: Union[str, None] = None):
+        # Parts are written in a partial file that replaces local_path once every part is in and verified
+        stat = self._stat(path)
+        part_size = self.range_config.part_size
+        checkpoint = Checkpoint(checkpoint_path(local_path, path, checkpoint_dir),
+                                {'download': path, 'size': stat.size, 'etag': stat.etag, 'part_size': part_size})
+        partial_path = f'{checkpoint.path}.partial'
+        resume = checkpoint.stale is None and os.path.isfile(partial_path)
+        done = set(checkpoint.state.get('parts', [])) if resume else set()
+        if done:
+            self._core_logger.info(f'Resuming the download of {path} to {local_path} ({len(done)} parts done)')
+
+        lock = threading.Lock()
+        with open(partial_path, 'r+b' if resume else 'wb') as f:
+            def fetch(part):
+                start, end = part * part_size, min((part + 1) * part_size, stat.size)
+                data = self._read_range_throttled(path, start, end, stat.etag)
+                if len(data) != end - start:
+                    raise IOError(f'{path}: expected {end - start} bytes from offset {start}, got {len(data)}')
+                with lock:
+                    f.seek(start)
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    # Parts are recorded only once they are on disk
+                    done.add(part)
+                    checkpoint.state['parts'] = sorted(done)
+                    checkpoint.save()
+
+            parts = [part for part in range(-(-stat.size // part_size)) if part not in done]
+            with self._executor(self.range_config.max_workers, 'part') as executor:
+                for future in [executor.submit(fetch, part) for part in parts]:
+                    future.result()
+            f.truncate(stat.size)
+
+        if stat.md5 is not None:
+            with open(partial_path, 'rb') as f:
+                md5 = part_digests(f, part_size)[0]
+            if md5 != stat.md5:
+                os.remove(partial_path)
+                checkpoint.remove()
+                raise ChecksumError(f'{path}: downloaded md5 {md5} does not match the stored md5 {stat.md5}')
+        os.replace(partial_path, local_path)
+        checkpoint.remove()
+
+    def abort_resumable(self, object_filename: str, filename: str, folder: Union[str, None] = None,
+                        checkpoint_dir: Union[str, None] = None):
+        # Cleans up an interrupted resumable upload of object_filename (local) to filename
+        path = self._get_full_path(filename, folder)
+        checkpoint = Checkpoint(checkpoint_path(object_filename, path, checkpoint_dir), None)
+        self._abort_resumable_upload(path, checkpoint.state)
+        checkpoint.remove()
+
+    def _stream_copy(self, dest_storage: 'Storage', object_name: str, verify: bool):
+        source_stat = self._stat(object_name) if verify else None
+
+        with self._open_stream(object_name) as stream:
+            reader = HashingReader(self._throttled(stream))
+            dest_storage._upload_fileobj(reader, object_name)
+        self._core_logger.debug(f'{object_name} copied to {dest_storage.__class__.__name__} '
+                                f'({reader.bytes_read} bytes)')
+
+        if verify:
+            dest_stat = dest_storage._stat(object_name)
+            if reader.bytes_read != source_stat.size or dest_stat.size != source_stat.size:
+                raise ChecksumError(f'{object_name}: size mismatch (source {source_stat.size}, '
+                                    f'streamed {reader.bytes_read}, destination {dest_stat.size})')
+            for side, md5 in (('source', source_stat.md5), ('destination', dest_stat.md5)):
+                if md5 is not None and md5 != reader.hexdigest():
+                    raise ChecksumError(f'{object_name}: {side} md5 {md5} does not match '
+                                        f'the streamed md5 {reader.hexdigest()}')
+
+    def copy_to(self, dest_storage: 'Storage', files: Union[str, list, Generator], max_workers: int = 8,
+                verify: bool = True):
+        # Every worker holds at most one chunk per stream, so in-flight memory is bounded by max_workers
+        if isinstance(files, str):
+            files = [files]
+
+        with self._executor(max_workers, 'copy') as executor:
+            pending = set()
+            for storage_object in files:
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(self._stream_copy, dest_storage, self._object_name(storage_object),
+                                            verify))
+
+            for future in pending:
+                future.result()
+
+    def map(self, fn, files: Union[str, list, Generator], processes: Union[int, None] = None,
+            chunksize: int = 1) -> list:
+        # fn(storage, object_name) runs in worker processes, it must be picklable (defined at module level).
+        # Results are returned in the order of files
+        if isinstance(files, str):
+            files = [files]
+        object_names = [self._object_name(storage_object) for storage_object in files]
+
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_map_worker,
+                                 initargs=(pickle.dumps(self),)) as executor:
+            return list(executor.map(_map_worker, [fn] * len(object_names), object_names, chunksize=chunksize))
+
     ###########
     # READERS #
     ###########
 
+    @abstractmethod
+    def _read_to_buffer(self, path: str):
+        pass
+
+    def _parse_buffer(self, reader: str, buff, **kwargs):
+        with self._span(f'parse {reader}', SERIALIZATION):
+            if self.parser_pool is None or reader not in ('csv', 'excel', 'yaml'):
+                return parse(reader, buff, **kwargs)
+            return self.parser_pool.parse(reader, buff.getbuffer(), **kwargs)
+
     @abstractmethod
     def read_csv(self, filename: str, folder: Union[str, None] = None, **kwargs):
         pass
@@ -83,9 +676,202 @@ class Storage(ABC):
     def read_object(self, filename: str, folder: Union[str, None] = None, **kwargs):
         pass
 
+    def open(self, filename: str, folder: Union[str, None] = None, mode: str = 'rb', block_size: int = MB,
+             max_read_ahead: Union[int, None] = None, cache_blocks: int = 32, **kwargs):
+        # Seekable file fetched lazily with ranged GETs of the version found when opening, for libraries that read
+        # parts of an object (pyarrow, zipfile, h5py, openpyxl). Sequential reads fetch up to max_read_ahead bytes
+        # ahead (the range part size by default). 'r' opens it as text, kwargs go to io.TextIOWrapper
+        if mode not in ('rb', 'r'):
+            raise ValueError(f'Invalid mode ({mode}), objects can only be opened for reading')
+        path = self._get_full_path(filename, folder)
+        stat = self._stat(path)
+        raw = CachedRangedFile(lambda start, end: self._read_range_throttled(path, start, end, stat.etag), stat.size,
+                               block_size, self.range_config.part_size if max_read_ahead is None else max_read_ahead,
+                               cache_blocks)
+        buffered = io.BufferedReader(raw, buffer_size=block_size)
+        return buffered if mode == 'rb' else io.TextIOWrapper(buffered, **kwargs)
+
+    def read_arrow(self, filename: str, folder: Union[str, None] = None, **kwargs) -> pa.Table:
+        with self._arrow_buffer(self._get_full_path(filename, folder)) as source:
+            return pq.read_table(source, **kwargs)
+
+    def iter_record_batches(self, filename: str, folder: Union[str, None] = None,
+                            columns: Union[list, None] = None) -> Generator:
+        # Row group by row group, only one of them is in memory at a time
+        with self._arrow_ranged(self._get_full_path(filename, folder)) as source:
+            parquet_file = pq.ParquetFile(source)
+            for row_group in range(parquet_file.num_row_groups):
+                yield from parquet_file.read_row_group(row_group, columns=columns).to_batches()
+
+    @staticmethod
+    def _read_ipc(source, columns: Union[list, None]) -> pa.Table:
+        # IPC files start with the ARROW1 magic, streams with their schema
+        is_file = source.read(6) == b'ARROW1'
+        source.seek(0)
+        table = (pa.ipc.open_file(source) if is_file else pa.ipc.open_stream(source)).read_all()
+        return table if columns is None else table.select(columns)
+
+    def read_feather(self, filename: str, folder: Union[str, None] = None, columns: Union[list, None] = None,
+                     cache_dir: Union[str, None] = None, as_table: bool = False, **kwargs):
+        # Arrow IPC (Feather v2) files or streams. With a cache_dir the object is kept on local disk and memory
+        # mapped, uncompressed columns are then read without copies
+        path = self._get_full_path(filename, folder)
+        if cache_dir is not None:
+            with pa.memory_map(str(self._cache_locally(path, cache_dir))) as source:
+                table = self._read_ipc(source, columns)
+        else:
+            with self._arrow_buffer(path) as source:
+                table = self._read_ipc(source, columns)
+        return table if as_table else table.to_pandas(**kwargs)
+
+    def read_jsonl(self, filename: str, folder: Union[str, None] = None, compression: Union[str, None] = 'infer',
+                   chunksize: Union[int, None] = None, **kwargs) -> Generator:
+        # Records parsed line by line from the streamed body, or DataFrames of chunksize records
+        path = self._get_full_path(filename, folder)
+        with self._open_stream(path) as stream:
+            with io.BufferedReader(StreamReader(self._throttled(stream)), self.range_config.part_size) as raw:
+                with decompressing_reader(raw, infer_compression(path, compression)) as lines:
+                    records = (json.loads(line, **kwargs) for line in lines if line.strip())
+                    if chunksize is None:
+                        yield from records
+                    else:
+                        batch = []
+                        for record in records:
+                            batch.append(record)
+                            if len(batch) == chunksize:
+                                yield pd.DataFrame.from_records(batch)
+                                batch = []
+                        if batch:
+                            yield pd.DataFrame.from_records(batch)
+
+    def read_if_modified(self, filename: str, folder: Union[str, None] = None, etag: Union[str, None] = None,
+                         reader: str = 'bytes', **kwargs) -> ConditionalRead:
+        # Sends the last seen etag (S3/Azure ETag, GCS generation): an unchanged object costs an empty response
+        # and returns the value parsed the last time it changed
+        path = self._get_full_path(filename, folder)
+        cache_key = (path, reader, repr(sorted(kwargs.items())))
+        with self._revalidation_cache_lock:
+            cached = self._revalidation_cache.get(cache_key)
+        if etag is None and cached is not None:
+            etag = cached.etag
+
+        data, stat = self._read_if_none_match(path, etag)
+        if data is None:
+            value = cached.value if cached is not None and cached.etag == stat.etag else None
+            return ConditionalRead(modified=False, etag=stat.etag, value=value)
+
+        with MemoryViewReader(data) as buff:
+            value = self._parse_buffer(reader, buff, **kwargs)
+        with self._revalidation_cache_lock:
+            self._revalidation_cache[cache_key] = ConditionalRead(modified=True, etag=stat.etag, value=value)
+            self._revalidation_cache.move_to_end(cache_key)
+            while len(self._revalidation_cache) > self.REVALIDATION_CACHE_SIZE:
+                self._revalidation_cache.popitem(last=False)
+        return ConditionalRead(modified=True, etag=stat.etag, value=value)
+
+    def _read_parsed(self, path: str, reader: str, kwargs: dict):
+        if self._result_cache is None or reader not in ResultCache.READERS:
+            with self._read_to_buffer(path) as buff:
+                return self._parse_buffer(reader, buff, **kwargs)
+
+        stat = self._stat(path)
+        key = self._result_cache.key(self._object_uri(path), stat.etag, reader, kwargs)
+        value = self._result_cache.get(key)
+        if value is None:
+            with MemoryViewReader(self._download_version(path, stat)) as buff:
+                value = self._parse_buffer(reader, buff, **kwargs)
+            self._result_cache.put(key, value)
+        else:
+            self._core_logger.debug(f'{path} read from the result cache')
+        return value
+
+    def _resolve_objects(self, files_or_folder: Union[str, list, Generator],
+                         folder: Union[str, None] = None) -> Generator:
+        # (name, path) of every object. A string is the folder to list, in folder when one is given, and the listed
+        # keys are full paths. The file names of a list are resolved like the filename of the read_* methods
+        if isinstance(files_or_folder, str):
+            listed_folder = files_or_folder if folder is None else f'{folder.rstrip("/")}/{files_or_folder}'
+            for storage_object in self.list_objects(listed_folder):
+                object_name = self._object_name(storage_object)
+                yield object_name, object_name
+            return
+
+        for storage_object in files_or_folder:
+            if isinstance(storage_object, str):
+                yield storage_object, self._get_full_path(storage_object, folder)
+            else:
+                # Blob objects of a listing
+                yield storage_object.name, storage_object.name
+
+    def iter_read(self, files_or_folder: Union[str, list, Generator], folder: Union[str, None] = None,
+                  reader: str = 'parquet', prefetch: int = 4, max_workers: int = 4, **kwargs) -> Generator:
+        # Yields (object name, value) in order while the next prefetch objects are downloaded and parsed in the
+        # background, at most prefetch + 1 objects are held in memory
+        with self._executor(max_workers, 'read') as executor:
+            pending = deque()
+            try:
+                for object_name, path in self._resolve_objects(files_or_folder, folder):
+                    pending.append((object_name, executor.submit(self._read_parsed, path, reader, kwargs)))
+                    while len(pending) > prefetch:
+                        object_name, future = pending.popleft()
+                        yield object_name, future.result()
+
+                while pending:
+                    object_name, future = pending.popleft()
+                    yield object_name, future.result()
+            finally:
+                # The consumer stopped early, do not download what will not be read
+                for _, future in pending:
+                    future.cancel()
+
+    def _read_many(self, files_or_folder: Union[str, list, Generator], folder: Union[str, None], parse_table,
+                   max_workers: int, source_column: Union[str, None]) -> pd.DataFrame:
+        # Shards are fetched concurrently, parsed into Arrow and converted to pandas once after concatenating
+        def read_table(resolved):
+            object_name, path = resolved
+            data = self._download_to_memory(path)
+            with self._span('parse table', SERIALIZATION, path=path):
+                table = parse_table(data)
+            if source_column is not None:
+                source = pa.array([object_name] * table.num_rows, pa.string()).dictionary_encode()
+                table = table.append_column(source_column, source)
+            return table
+
+        with self._executor(max_workers, 'read') as executor:
+            tables = list(executor.map(read_table, self._resolve_objects(files_or_folder, folder)))
+
+        if not tables:
+            return pd.DataFrame()
+        return pa.concat_tables(tables).to_pandas()
+
+    def read_csv_many(self, files_or_folder: Union[str, list, Generator], folder: Union[str, None] = None,
+                      max_workers: int = 8, processes: Union[int, None] = None, source_column: Union[str, None] = None,
+                      **kwargs) -> pd.DataFrame:
+        # kwargs are the pyarrow.csv.read_csv options (read_options, parse_options, convert_options)
+        # The parser pool is reused when there is one, processes only sizes the pool started without it
+        if self.parser_pool is None:
+            executor_context = ProcessPoolExecutor(max_workers=processes)
+        else:
+            if processes is not None:
+                self._core_logger.warning(f'processes={processes} ignored, the CSV files are parsed by the parser pool')
+            executor_context = nullcontext(self.parser_pool.executor)
+        with executor_context as process_executor:
+            def parse_table(data):
+                # Parsing CSV holds the GIL, the download threads hand it over to the worker processes
+                return ipc_to_table(process_executor.submit(csv_to_ipc, bytes(data), **kwargs).result())
+
+            return self._read_many(files_or_folder, folder, parse_table, max_workers, source_column)
+
+    def read_parquet_many(self, files_or_folder: Union[str, list, Generator], folder: Union[str, None] = None,
+                          max_workers: int = 8, source_column: Union[str, None] = None, **kwargs) -> pd.DataFrame:
+        # kwargs are the pyarrow.parquet.read_table options, like columns
+        return self._read_many(files_or_folder, folder, lambda data: pq.read_table(pa.BufferReader(data), **kwargs),
+                               max_workers, source_column)
+
     @abstractmethod
     def read_object_to_file(self, object_filename: str, filename: Union[str, None] = None,
-                            folder: Union[str, None] = None, **kwargs):
+                            folder: Union[str, None] = None, resumable: bool = False,
+                            checkpoint_dir: Union[str, None] = None, verify: bool = False, **kwargs):
         pass
 
     ###########
@@ -93,29 +879,103 @@ class Storage(ABC):
     ###########
 
     @abstractmethod
-    def write_csv(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_csv(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                  if_changed: bool = False, **kwargs):
         pass
 
     @abstractmethod
-    def write_excel(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_excel(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                    if_changed: bool = False, **kwargs):
         pass
 
     @abstractmethod
-    def write_parquet(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_parquet(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                      if_changed: bool = False, **kwargs):
         pass
 
     @abstractmethod
-    def write_yaml(self, data: dict, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_yaml(self, data: dict, filename: str, folder: Union[str, None] = None,
+                   if_changed: bool = False, **kwargs):
         pass
 
     @abstractmethod
-    def write_json(self, data: dict, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_json(self, data: dict, filename: str, folder: Union[str, None] = None,
+                   if_changed: bool = False, **kwargs):
         pass
 
     @abstractmethod
-    def write_object(self, write_object, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_object(self, write_object, filename: str, folder: Union[str, None] = None,
+                     if_changed: bool = False, **kwargs):
         pass
 
     @abstractmethod
-    def write_object_from_file(self, object_filename: str, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_object_from_file(self, object_filename: str, filename: str, folder: Union[str, None] = None,
+                               if_changed: bool = False, resumable: bool = False,
+                               checkpoint_dir: Union[str, None] = None, verify: bool = False, **kwargs):
         pass
+
+    def _jsonl_chunks(self, records, **kwargs):
+        # Serialized lines are grouped in part_size chunks so memory does not grow with the number of records
+        lines, size = [], 0
+        for record in records:
+            line = (json.dumps(record, **kwargs) + '\n').encode()
+            lines.append(line)
+            size += len(line)
+            if size >= self.range_config.part_size:
+                yield b''.join(lines)
+                lines, size = [], 0
+        if lines:
+            yield b''.join(lines)
+
+    def write_jsonl(self, records, filename: str, folder: Union[str, None] = None,
+                    compression: Union[str, None] = 'infer', if_changed: bool = False, **kwargs):
+        # Records are serialized and compressed while the upload reads them, in multipart/block uploads when big
+        path = self._get_full_path(filename, folder)
+        chunks = compress_chunks(self._jsonl_chunks(records, **kwargs), infer_compression(path, compression))
+        with io.BufferedReader(IterableReader(chunks), self.range_config.part_size) as stream:
+            self._upload_stream(stream, path, if_changed=if_changed)
+
+    @staticmethod
+    def _parquet_chunks(batches, **kwargs):
+        sink = ChunkSink()
+        writer = None
+        for batch in batches:
+            if writer is None:
+                writer = pq.ParquetWriter(sink, batch.schema, **kwargs)
+            # Every batch becomes a row group that is handed to the upload as soon as it is encoded
+            writer.write_table(pa.Table.from_batches([batch]))
+            yield sink.drain()
+        if writer is not None:
+            writer.close()
+            yield sink.drain()
+
+    def write_arrow(self, data: Union[pa.Table, list, Generator], filename: str, folder: Union[str, None] = None,
+                    if_changed: bool = False, **kwargs):
+        # Parquet from a pyarrow Table or an iterable of RecordBatches, kwargs are the ParquetWriter options
+        path = self._get_full_path(filename, folder)
+        if isinstance(data, pa.Table):
+            with io.BytesIO() as buff:
+                pq.write_table(data, buff, **kwargs)
+                self._upload_buffer(buff, path, if_changed=if_changed)
+        else:
+            with io.BufferedReader(IterableReader(self._parquet_chunks(data, **kwargs)),
+                                   self.range_config.part_size) as stream:
+                self._upload_stream(stream, path, if_changed=if_changed)
+
+    def write_feather(self, data: Union[pd.DataFrame, pa.Table], filename: str, folder: Union[str, None] = None,
+                      ipc_format: str = 'file', compression: Union[str, None] = None, if_changed: bool = False,
+                      **kwargs):
+        # ipc_format is 'file' (Feather v2, random access) or 'stream', compression is None, 'lz4' or 'zstd'.
+        # kwargs are the pyarrow.Table.from_pandas options
+        table = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data, **kwargs)
+        if ipc_format == 'file':
+            new_writer = pa.ipc.new_file
+        elif ipc_format == 'stream':
+            new_writer = pa.ipc.new_stream
+        else:
+            raise ValueError(f'Unknown IPC format {ipc_format}, use file or stream')
+
+        with io.BytesIO() as buff:
+            with new_writer(buff, table.schema, options=pa.ipc.IpcWriteOptions(compression=compression)) as writer:
+                writer.write_table(table)
+            self._upload_buffer(buff, self._get_full_path(filename, folder), if_changed=if_changed)
@@ -0,0 +1,78 @@
+import threading
+import time
+from typing import Union
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate: float, capacity: float):
+        # Callers take tokens even when there are not enough and then wait for the debt to be refilled, so amounts
+        # bigger than the capacity are paced at rate instead of blocking forever
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: float):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RateLimiter(object):
+
+    def __init__(self, bytes_per_second: Union[float, None] = None, requests_per_second: Union[float, None] = None,
+                 burst_seconds: float = 1.0):
+        # One instance can be shared by several storages to shape all of them together
+        self.bytes_per_second = bytes_per_second
+        self.requests_per_second = requests_per_second
+        self.burst_seconds = burst_seconds
+        self._bytes = None
+        self._requests = None
+        if bytes_per_second is not None:
+            self._bytes = TokenBucket(bytes_per_second, bytes_per_second * burst_seconds)
+        if requests_per_second is not None:
+            self._requests = TokenBucket(requests_per_second, max(requests_per_second * burst_seconds, 1))
+
+    def __reduce__(self):
+        # A limiter sent to another process starts with full buckets, each process is paced on its own
+        return self.__class__, (self.bytes_per_second, self.requests_per_second, self.burst_seconds)
+
+    def throttle_bytes(self, size: int):
+        if self._bytes is not None and size > 0:
+            self._bytes.consume(size)
+
+    def throttle_request(self):
+        if self._requests is not None:
+            self._requests.consume(1)
+
+
+class ThrottledFile(object):
+    # Proxy of a file object that paces what is read from or written to it
+
+    def __init__(self, fileobj, rate_limiter: RateLimiter):
+        self._fileobj = fileobj
+        self._rate_limiter = rate_limiter
+
+    def read(self, *args, **kwargs):
+        data = self._fileobj.read(*args, **kwargs)
+        self._rate_limiter.throttle_bytes(len(data))
+        return data
+
+    def readinto(self, b):
+        size = self._fileobj.readinto(b)
+        self._rate_limiter.throttle_bytes(size or 0)
+        return size
+
+    def write(self, b):
+        self._rate_limiter.throttle_bytes(len(b))
+        return self._fileobj.write(b)
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+
+MB = 1024 * 1024
+
+
+class RangeConfig(object):
+
+    def __init__(self, threshold: int = 16 * MB, part_size: int = 8 * MB, max_workers: int = 8):
+        self.threshold = threshold
+        self.part_size = part_size
+        self.max_workers = max_workers
+
+
+def ranged_download(read_first_range, read_range, config: RangeConfig,
+                    executor_factory=ThreadPoolExecutor) -> Union[bytes, bytearray]:
+    # read_first_range(end) -> (bytes, ObjectStat) and read_range(start, end, etag) -> bytes
+    first, stat = read_first_range(config.threshold)
+    if stat.size <= len(first):
+        return first
+
+    buffer = bytearray(stat.size)
+    view = memoryview(buffer)
+    view[:len(first)] = first
+
+    def fetch(start, end):
+        data = read_range(start, end, stat.etag)
+        if len(data) != end - start:
+            raise IOError(f'{stat.name}: expected {end - start} bytes from offset {start}, got {len(data)}')
+        view[start:end] = data
+
+    ranges = [(start, min(start + config.part_size, stat.size))
+              for start in range(len(first), stat.size, config.part_size)]
+    with executor_factory(max_workers=max(min(config.max_workers, len(ranges)), 1)) as executor:
+        for future in [executor.submit(fetch, start, end) for start, end in ranges]:
+            future.result()
+
+    view.release()
+    return buffer
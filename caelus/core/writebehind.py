@@ -0,0 +1,70 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class WriteBehindError(Exception):
+    # Raised by flush with the (key, exception) of every failed write since the previous flush
+
+    def __init__(self, errors: list):
+        Exception.__init__(self, f'{len(errors)} queued writes failed, first on {errors[0][0]}: {errors[0][1]!r}')
+        self.errors = errors
+
+
+class WriteBehindQueue(object):
+    # Runs writes in background threads. submit blocks while max_pending writes are queued or running, and writes
+    # to the same key run in submission order
+    _core_logger = logging.getLogger('core')
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 16):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='write-behind')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._last_by_key = {}
+        self._errors = []
+
+    def submit(self, key: str, fn):
+        self._slots.acquire()
+        with self._lock:
+            previous = self._last_by_key.get(key)
+
+            def task():
+                if previous is not None:
+                    # Submitted earlier, so already running or done and never waiting behind this task
+                    wait([previous])
+                fn()
+
+            future = self._executor.submit(task)
+            self._pending.add(future)
+            self._last_by_key[key] = future
+        future.add_done_callback(lambda done: self._done(key, done))
+        return future
+
+    def _done(self, key: str, future):
+        with self._lock:
+            self._pending.discard(future)
+            if self._last_by_key.get(key) is future:
+                del self._last_by_key[key]
+            if future.exception() is not None:
+                self._core_logger.warning(f'Queued write of {key} failed: {future.exception()!r}')
+                self._errors.append((key, future.exception()))
+        self._slots.release()
+
+    def wait(self):
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+
+    def flush(self):
+        self.wait()
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise WriteBehindError(errors)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
@@ -1,6 +1,7 @@
 import logging
 from typing import Union
 
+from google.auth.credentials import AnonymousCredentials
 from google.oauth2 import service_account
 
 
@@ -8,15 +9,27 @@ class GCPAuth(object):
     _gcp_logger = logging.getLogger('gcp')
 
     def __init__(self, project_id: Union[None, str] = None, credentials_file: Union[None, str] = None,
-                 account_info: Union[None, str] = None):
+                 account_info: Union[None, str] = None, anonymous: bool = False):
         self._project_id = project_id
+        self._credentials_file = credentials_file
+        self._account_info = account_info
+        self._anonymous = anonymous
+        self._credential = None
 
-        if credentials_file is not None:
+        if anonymous:
+            # Unauthenticated access, used against public buckets and local emulators
+            self._credential = AnonymousCredentials()
+
+        elif credentials_file is not None:
             self._credential = service_account.Credentials.from_service_account_file(credentials_file)
 
         elif account_info is not None:
             self._credential = service_account.Credentials.from_service_account_info(info=account_info)
 
+    def __reduce__(self):
+        # Credentials hold a signer that can not be pickled, they are loaded again from the construction parameters
+        return self.__class__, (self._project_id, self._credentials_file, self._account_info, self._anonymous)
+
     @property
     def project_id(self):
         return self._project_id
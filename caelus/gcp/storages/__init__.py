@@ -1,5 +1,6 @@
-from .cloud_storage import CloudStorage
+from .cloud_storage import CloudStorage, CloudTransferConfig
 
 __all__ = [
     'CloudStorage',
+    'CloudTransferConfig',
 ]
@@ -1,51 +1,221 @@
 import io
+import itertools
 import json
 import logging
+import mimetypes
+import os
+import time
 from contextlib import contextmanager
 from tempfile import TemporaryFile
 from typing import Union, Generator
+from urllib.parse import urlparse
 
 import yaml
+from google.api_core.exceptions import GoogleAPICallError, NotFound, from_http_response
 from google.cloud import storage
 from google.cloud.storage.blob import Blob
 
 import pandas as pd
 
-from caelus.core.storages import Storage
+from caelus.core.buffers import MemoryViewReader
+from caelus.core.checkpoints import Checkpoint
+from caelus.core.checksums import b64_to_hex, file_digest, StreamingDigest, DigestReader, DigestWriter
+from caelus.core.storages import Storage, ObjectStat
+from caelus.core.transfers import RangeConfig, MB
 from caelus.gcp.auth import GCPAuth
 
 
+class CloudTransferConfig(object):
+
+    def __init__(self, chunk_size: int = 8 * MB, threshold: int = 16 * MB, max_workers: int = 8):
+        # chunk_size must be a multiple of 256KB, it sizes resumable uploads, chunked downloads and ranged reads
+        self.chunk_size = chunk_size
+        self.threshold = threshold
+        self.max_workers = max_workers
+
+
 class CloudStorage(Storage):
     _gcp_logger = logging.getLogger('gcp')
 
-    def __init__(self, auth: GCPAuth, bucket_name: str, base_path: str = ""):
+    LIST_FIELDS = 'items(name,size,md5Hash,generation,updated,contentType),nextPageToken'
+
+    def __init__(self, auth: GCPAuth, bucket_name: str, base_path: str = "", endpoint_url: Union[None, str] = None):
         Storage.__init__(self, base_path=base_path)
         self._bucket_name = bucket_name
-        self.storage_client = storage.Client(project=auth.project_id, credentials=auth.credential)
-        self.bucket = self.storage_client.get_bucket(self._bucket_name)
+        self._auth = auth
+        self._endpoint_url = endpoint_url
+
+        self.transfer_config = CloudTransferConfig()
+
+    def _create_storage_client(self) -> storage.Client:
+        client_options = {'api_endpoint': self._endpoint_url} if self._endpoint_url is not None else None
+        storage_client = storage.Client(project=self._auth.project_id, credentials=self._auth.credential,
+                                        client_options=client_options)
+        # Each response waits for the rate limiter before the caller can send its next request
+        storage_client._http.hooks['response'].append(self._throttle_request)
+        storage_client._http.hooks['response'].append(self._request_finished)
+        return storage_client
+
+    def _request_finished(self, response, *args, **kwargs):
+        # Hooks only see the response, the span starts elapsed before it
+        end = time.perf_counter()
+        self._record_request(response.request.method, end - response.elapsed.total_seconds(), end,
+                             path=urlparse(response.request.url).path, status=response.status_code)
+
+    @property
+    def storage_client(self) -> storage.Client:
+        return self._client('storage_client', self._create_storage_client)
+
+    @property
+    def bucket(self):
+        return self._client('bucket', lambda: self.storage_client.get_bucket(self._bucket_name))
 
     @property
     def bucket_name(self):
         return self._bucket_name
 
+    @property
+    def transfer_config(self) -> CloudTransferConfig:
+        return self._transfer_config
+
+    @transfer_config.setter
+    def transfer_config(self, new_transfer_config):
+        self._transfer_config = new_transfer_config
+        self.range_config = RangeConfig(threshold=new_transfer_config.threshold,
+                                        part_size=new_transfer_config.chunk_size,
+                                        max_workers=new_transfer_config.max_workers)
+
+    def _blob(self, path: str, **kwargs) -> Blob:
+        return self.bucket.blob(path, chunk_size=self.transfer_config.chunk_size, **kwargs)
+
+    def _object_uri(self, path: str) -> str:
+        return f'gs://{self._bucket_name}/{path}'
+
+    ##############
+    # PRIMITIVES #
+    ##############
+    def _stat(self, path: str) -> ObjectStat:
+        blob = self.bucket.get_blob(path)
+        if blob is None:
+            raise FileNotFoundError(f'{path} not found in {self.bucket_name}')
+        return self._blob_stat(blob)
+
+    @staticmethod
+    def _blob_stat(blob: Blob) -> ObjectStat:
+        # The generation identifies the object content, the GCS etag also changes with metadata updates
+        return ObjectStat(name=blob.name, size=blob.size, etag=str(blob.generation), md5=b64_to_hex(blob.md5_hash),
+                          last_modified=blob.updated, content_type=blob.content_type)
+
+    def _list_stats(self, prefix: str) -> Generator:
+        for blob in self.storage_client.list_blobs(bucket_or_name=self.bucket_name, prefix=prefix,
+                                                   fields=self.LIST_FIELDS):
+            yield self._blob_stat(blob)
+
+    def _stat_paths(self, paths: list, max_workers: int) -> list:
+        # Metadata requests go in batches of 100, the most a GCS batch request takes
+        stats = []
+        for start in range(0, len(paths), 100):
+            blobs = [self.bucket.blob(path) for path in paths[start:start + 100]]
+            try:
+                with self.storage_client.batch():
+                    for blob in blobs:
+                        blob.reload()
+            except GoogleAPICallError:
+                # The batch raises the first failure once every response is in. The blobs of failed requests keep
+                # the placeholder of the batch instead of a dict of properties, they are checked one by one to
+                # tell missing objects from other errors
+                pass
+            failed = [blob.name for blob in blobs if type(blob._properties) is not dict]
+            rechecked = dict(zip(failed, super()._stat_paths(failed, max_workers)))
+            stats += [rechecked[blob.name] if blob.name in rechecked else self._blob_stat(blob) for blob in blobs]
+        return stats
+
+    def _read_range(self, path: str, start: int, end: int, etag: Union[str, None] = None) -> bytes:
+        if end <= start:
+            return b''
+        generation = None if etag is None else int(etag)
+        return self.bucket.blob(path, generation=generation).download_as_string(start=start, end=end - 1)
+
+    def _upload_fileobj(self, fileobj, path: str, **kwargs):
+        if isinstance(fileobj, io.BytesIO):
+            # Known sizes let small payloads go in a single multipart request instead of a resumable session
+            kwargs.setdefault('size', fileobj.getbuffer().nbytes - fileobj.tell())
+        self._blob(path).upload_from_file(self._throttled(fileobj), **kwargs)
+
+    @staticmethod
+    def _session_response_offset(response) -> Union[int, None]:
+        # Bytes persisted by a resumable session, None once the upload is complete. Expired sessions answer 404 or 410
+        if response.status_code in (200, 201):
+            return None
+        elif response.status_code == 308:
+            persisted = response.headers.get('Range')
+            return int(persisted.rpartition('-')[2]) + 1 if persisted else 0
+        elif response.status_code in (404, 410):
+            raise NotFound(f'Resumable session answered {response.status_code}')
+        raise from_http_response(response)
+
+    def _session_offset(self, session_uri: str, size: int) -> Union[int, None]:
+        response = self.storage_client._http.put(session_uri, headers={'Content-Range': f'bytes */{size}'})
+        return self._session_response_offset(response)
+
+    def _resumable_upload(self, local_path: str, path: str, checkpoint: Checkpoint, **kwargs):
+        size = os.path.getsize(local_path)
+        kwargs.setdefault('content_type', mimetypes.guess_type(local_path)[0])
+        if size == 0:
+            self._blob(path).upload_from_filename(local_path, **kwargs)
+            return
+
+        # Sessions live for a week and the service knows how many bytes it has, the checkpoint only keeps its URI
+        state = checkpoint.state
+        created = 'session_uri' not in state
+        if created:
+            state['session_uri'] = self._blob(path).create_resumable_upload_session(size=size, **kwargs)
+            checkpoint.save()
+
+        try:
+            offset = self._session_offset(state['session_uri'], size)
+            chunk_size = self.transfer_config.chunk_size
+            with open(local_path, 'rb') as f:
+                while offset is not None:
+                    f.seek(offset)
+                    data = f.read(chunk_size)
+                    self._throttle_bytes(len(data))
+                    response = self.storage_client._http.put(
+                        state['session_uri'], data=data,
+                        headers={'Content-Range': f'bytes {offset}-{offset + len(data) - 1}/{size}'})
+                    offset = self._session_response_offset(response)
+        except NotFound:
+            if created:
+                raise
+            self._gcp_logger.warning(f'Resumable session of {path} expired, restarting the upload')
+            state.clear()
+            return self._resumable_upload(local_path, path, checkpoint, **kwargs)
+
+    def _abort_resumable_upload(self, path: str, state: dict):
+        if 'session_uri' in state:
+            # Cancelled sessions answer 499
+            self.storage_client._http.delete(state['session_uri'])
+
     ################
     # OBJECT ADMIN #
     ################
     def _list_bucket_objects(self, prefix: str, filter_filename: Union[None, str] = None,
-                             only_files: bool = True, filter_extension: Union[None, str, tuple] = None) -> Generator:
-        response = self.storage_client.list_blobs(bucket_or_name=self.bucket_name, prefix=prefix)
-
-        while True:
-            for key in response:
-                filtered_key = self._filter_key(key, filter_filename, only_files, filter_extension)
-                if filtered_key is not None:
-                    yield filtered_key
-
-            if response.next_page_token is not None:
-                response = self.storage_client.list_blobs(bucket_or_name=self.bucket_name, prefix=prefix,
-                                                          page_token=response.next_page_token)
-            else:
-                break
+                             only_files: bool = True, filter_extension: Union[None, str, tuple] = None,
+                             page_size: Union[int, None] = None, max_results: Union[int, None] = None,
+                             fields: Union[str, None] = None) -> Generator:
+        if fields is not None and 'nextPageToken' not in fields:
+            fields = f'{fields},nextPageToken'
+        response = self.storage_client.list_blobs(bucket_or_name=self.bucket_name, prefix=prefix,
+                                                  max_results=max_results, fields=fields)
+        if page_size is not None:
+            # list_blobs of google-cloud-storage 1.27 has no page_size, the page size goes in the query parameters
+            response.extra_params['maxResults'] = page_size if max_results is None else min(page_size, max_results)
+
+        # The iterator follows nextPageToken on its own, every page is requested once
+        for key in itertools.islice(response, max_results):
+            filtered_key = self._filter_key(key, filter_filename, only_files, filter_extension)
+            if filtered_key is not None:
+                yield filtered_key
 
     @staticmethod
     def _filter_key(key, filter_filename, only_files, filter_extension):
@@ -58,9 +228,13 @@ class CloudStorage(Storage):
             return key
 
     def list_objects(self, folder: Union[None, str] = None, filter_filename: Union[None, str] = None,
-                     filter_extension: Union[None, str, tuple] = None) -> Generator:
+                     filter_extension: Union[None, str, tuple] = None, page_size: Union[int, None] = None,
+                     max_results: Union[int, None] = None, fields: Union[str, None] = None) -> Generator:
+        # fields is the JSON API projection of the listed resources, for example LIST_FIELDS. The default None
+        # returns every metadata field
         return self._list_bucket_objects(self._get_folder_path(folder), filter_filename=filter_filename,
-                                         filter_extension=filter_extension)
+                                         filter_extension=filter_extension, page_size=page_size,
+                                         max_results=max_results, fields=fields)
 
     def _blob_copy(self, dest_bucket_name: str, blob_name: str, dest_object_name: Union[str, None],
                    remove_copied: bool):
@@ -99,10 +273,7 @@ class CloudStorage(Storage):
     @contextmanager
     def _read_to_buffer(self, path):
         self._gcp_logger.debug(f'Reading from {self.bucket_name}: {path}')
-        blob_file = self.bucket.blob(path)
-        with io.BytesIO() as buff:
-            blob_file.download_to_file(buff)
-            buff.seek(0)
+        with MemoryViewReader(self._download_to_memory(path)) as buff:
             yield buff
 
     @contextmanager
@@ -114,12 +285,10 @@ class CloudStorage(Storage):
             yield buff
 
     def read_csv(self, filename: str, folder: Union[str, None] = None, **kwargs):
-        with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
-            return pd.read_csv(buff, **kwargs)
+        return self._read_parsed(self._get_full_path(filename, folder), 'csv', kwargs)
 
     def read_excel(self, filename: str, folder: Union[str, None] = None, **kwargs):
-        with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
-            return pd.read_excel(buff, **kwargs)
+        return self._read_parsed(self._get_full_path(filename, folder), 'excel', kwargs)
 
     def read_parquet(self, filename: str, folder: Union[str, None] = None, **kwargs):
         with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
@@ -127,7 +296,7 @@ class CloudStorage(Storage):
 
     def read_yaml(self, filename: str, folder: Union[str, None] = None, yaml_loader=yaml.FullLoader):
         with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
-            return yaml.load(buff, Loader=yaml_loader)
+            return self._parse_buffer('yaml', buff, yaml_loader=yaml_loader)
 
     def read_json(self, filename: str, folder: Union[str, None] = None, **kwargs):
         with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
@@ -138,12 +307,27 @@ class CloudStorage(Storage):
             return buff.read(**kwargs)
 
     def read_object_to_file(self, blob_object: Blob, filename: Union[str, None] = None,
-                            folder: Union[str, None] = None, **kwargs):
+                            folder: Union[str, None] = None, resumable: bool = False,
+                            checkpoint_dir: Union[str, None] = None, verify: bool = False, **kwargs):
         object_filename_full, filename = self._create_local_path(blob_object.name, filename, folder)
+        if resumable:
+            self._read_resumable(object_filename_full, filename, checkpoint_dir)
+            return
 
         self._gcp_logger.debug(f'Downloading {object_filename_full} to {filename}')
-        blob = self.bucket.blob(object_filename_full)
-        blob.download_to_filename(filename)
+        if verify:
+            # The metadata pins the generation downloaded and gives its crc32c
+            blob = self._blob(object_filename_full)
+            blob.reload()
+            digest = StreamingDigest()
+            with open(filename, 'wb') as f:
+                blob.download_to_file(DigestWriter(self._throttled(f), digest), **kwargs)
+            self._verify_digest(object_filename_full, digest, md5=b64_to_hex(blob.md5_hash), crc32c=blob.crc32c)
+        elif self.rate_limiter is None:
+            self._blob(object_filename_full).download_to_filename(filename, **kwargs)
+        else:
+            with open(filename, 'wb') as f:
+                self._blob(object_filename_full).download_to_file(self._throttled(f), **kwargs)
 
     ###########
     # WRITERS #
@@ -154,47 +338,75 @@ class CloudStorage(Storage):
 
         return bucket_path
 
-    def write_csv(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_csv(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                  if_changed: bool = False, **kwargs):
         with io.StringIO() as buff:
             df.to_csv(buff, **kwargs)
-            buff.seek(0)
-            self.bucket.blob(self._get_bucket_path(filename, folder)).upload_from_file(buff)
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
 
-    def write_excel(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_excel(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                    if_changed: bool = False, **kwargs):
         with io.BytesIO() as buff:
             df.to_excel(buff, **kwargs)
-            buff.seek(0)
-            self.bucket.blob(self._get_bucket_path(filename, folder)).upload_from_file(buff)
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
 
-    def write_parquet(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_parquet(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                      if_changed: bool = False, **kwargs):
         with io.BytesIO() as buff:
             df.to_parquet(buff, **kwargs)
-            buff.seek(0)
-            self.bucket.blob(self._get_bucket_path(filename, folder)).upload_from_file(buff)
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
 
-    def write_yaml(self, data: dict, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_yaml(self, data: dict, filename: str, folder: Union[str, None] = None,
+                   if_changed: bool = False, **kwargs):
         with io.StringIO() as buff:
             yaml.dump(data, buff, **kwargs)
-            buff.seek(0)
-            self.bucket.blob(self._get_bucket_path(filename, folder)).upload_from_file(buff)
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
 
-    def write_json(self, data: dict, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_json(self, data: dict, filename: str, folder: Union[str, None] = None,
+                   if_changed: bool = False, **kwargs):
         with io.StringIO() as buff:
             json.dump(data, buff, **kwargs)
-            buff.seek(0)
-            self.bucket.blob(self._get_bucket_path(filename, folder)).upload_from_file(buff)
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
 
-    def write_object(self, write_object, filename: str, folder: Union[str, None] = None, **kwargs):
+    def write_object(self, write_object, filename: str, folder: Union[str, None] = None,
+                     if_changed: bool = False, **kwargs):
         if isinstance(write_object, bytes):
-            self.bucket.blob(self._get_bucket_path(filename,
-                                                   folder)).upload_from_string(write_object,
-                                                                               content_type='application/octet-stream')
+            self._upload_buffer(io.BytesIO(write_object), self._get_bucket_path(filename, folder),
+                                if_changed=if_changed, content_type='application/octet-stream')
         elif isinstance(write_object, io.BytesIO):
-            self.bucket.blob(self._get_bucket_path(
-                filename, folder)).upload_from_string(write_object.getvalue(),
-                                                      content_type='application/octet-stream')
+            self._upload_buffer(write_object, self._get_bucket_path(filename, folder),
+                                if_changed=if_changed, content_type='application/octet-stream')
         else:
-            self.bucket.blob(self._get_bucket_path(filename, folder)).upload_from_file(write_object, **kwargs)
-
-    def write_object_from_file(self, object_filename: str, filename: str, folder: Union[str, None] = None, **kwargs):
-        self.bucket.blob(self._get_bucket_path(filename, folder)).upload_from_filename(object_filename, **kwargs)
+            self._upload_stream(write_object, self._get_bucket_path(filename, folder), if_changed=if_changed,
+                                **kwargs)
+
+    def write_object_from_file(self, object_filename: str, filename: str, folder: Union[str, None] = None,
+                               if_changed: bool = False, resumable: bool = False,
+                               checkpoint_dir: Union[str, None] = None, verify: bool = False, **kwargs):
+        bucket_path = self._get_bucket_path(filename, folder)
+        if if_changed and self._skip_unchanged_file(object_filename, bucket_path):
+            return
+        if resumable:
+            self._write_resumable(object_filename, bucket_path, checkpoint_dir, **kwargs)
+            if verify:
+                blob = self.bucket.get_blob(bucket_path)
+                self._verify_digest(bucket_path, file_digest(object_filename), md5=b64_to_hex(blob.md5_hash),
+                                    crc32c=blob.crc32c)
+            return
+        if verify:
+            # The upload response fills the crc32c and md5 of the stored object
+            kwargs.setdefault('content_type', mimetypes.guess_type(object_filename)[0])
+            blob = self._blob(bucket_path)
+            digest = StreamingDigest()
+            with open(object_filename, 'rb') as f:
+                blob.upload_from_file(DigestReader(self._throttled(f), digest),
+                                      size=os.path.getsize(object_filename), **kwargs)
+            self._verify_digest(bucket_path, digest, md5=b64_to_hex(blob.md5_hash), crc32c=blob.crc32c)
+        elif self.rate_limiter is None:
+            self._blob(bucket_path).upload_from_filename(object_filename, **kwargs)
+        else:
+            kwargs.setdefault('content_type', mimetypes.guess_type(object_filename)[0])
+            with open(object_filename, 'rb') as f:
+                self._blob(bucket_path).upload_from_file(self._throttled(f), size=os.path.getsize(object_filename),
+                                                         **kwargs)
+        self._record_upload('uploaded')
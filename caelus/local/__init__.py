@@ -0,0 +1,8 @@
+import logging
+
+__local_logger = logging.getLogger('local')
+__local_logger.setLevel(logging.INFO)
+
+__all__ = [
+    'storages',
+]
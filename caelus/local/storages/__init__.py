@@ -0,0 +1,5 @@
+from .local_storage import LocalStorage
+
+__all__ = [
+    'LocalStorage',
+]
@@ -0,0 +1,319 @@
+import errno
+import filecmp
+import io
+import json
+import logging
+import mimetypes
+import mmap
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Union, Generator
+
+import pandas as pd
+import pyarrow as pa
+import yaml
+
+from caelus.core.buffers import MemoryViewReader
+from caelus.core.checksums import part_digests
+from caelus.core.storages import Storage, ObjectStat
+from caelus.core.transfers import MB
+
+
+class LocalStorage(Storage):
+    _local_logger = logging.getLogger('local')
+
+    TMP_PREFIX = '.caelus-tmp-'
+
+    def __init__(self, root_path: str, base_path: str = ""):
+        Storage.__init__(self, base_path=base_path)
+
+        self._root_path = Path(root_path).resolve()
+        self._root_path.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def root_path(self) -> str:
+        return str(self._root_path)
+
+    def _local_path(self, path: str, root_path: Union[str, None] = None) -> Path:
+        root_path = self._root_path if root_path is None else Path(root_path)
+        return root_path / path
+
+    def _object_uri(self, path: str) -> str:
+        return self._local_path(path).as_uri()
+
+    ##############
+    # PRIMITIVES #
+    ##############
+    def _stat(self, path: str) -> ObjectStat:
+        file_stat = os.stat(self._local_path(path))
+        # No stored checksum, the etag changes whenever the file is rewritten
+        return ObjectStat(name=path, size=file_stat.st_size, etag=f'{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}',
+                          md5=None, last_modified=datetime.fromtimestamp(file_stat.st_mtime, tz=timezone.utc),
+                          content_type=mimetypes.guess_type(path)[0])
+
+    def _read_range(self, path: str, start: int, end: int, etag: Union[str, None] = None) -> bytes:
+        with open(self._local_path(path), 'rb') as f:
+            f.seek(start)
+            return f.read(max(end - start, 0))
+
+    @contextmanager
+    def _open_stream(self, path: str):
+        with open(self._local_path(path), 'rb') as stream:
+            yield stream
+
+    @contextmanager
+    def _arrow_buffer(self, path: str):
+        with pa.memory_map(str(self._local_path(path))) as source:
+            yield source
+
+    # Memory maps are already paged in on demand
+    _arrow_ranged = _arrow_buffer
+
+    def _cache_locally(self, path: str, cache_dir: str) -> Path:
+        return self._local_path(path)
+
+    def _checksum_matches(self, stat: ObjectStat, fileobj) -> bool:
+        # No stored checksum, but hashing the current file is cheap
+        with open(self._local_path(stat.name), 'rb') as f:
+            md5 = part_digests(f, self.range_config.part_size)[0]
+        return md5 == part_digests(fileobj, self.range_config.part_size)[0]
+
+    def _upload_fileobj(self, fileobj, path: str, **kwargs):
+        with self._atomic_path(self._local_path(path)) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(self._throttled(fileobj), f, self.range_config.part_size)
+
+    ################
+    # OBJECT ADMIN #
+    ################
+    def _list_local_objects(self, prefix: str, filter_filename: Union[None, str] = None,
+                            only_files: bool = True, filter_extension: Union[None, str, tuple] = None) -> Generator:
+        # Prefixes behave like in the object stores: 'data/part' matches 'data/part-0.csv'
+        prefix_folder = self._local_path(prefix.rpartition('/')[0])
+        if not prefix_folder.is_dir():
+            return
+
+        for dir_path, dir_names, file_names in os.walk(prefix_folder):
+            dir_names.sort()
+            relative_dir = Path(dir_path).relative_to(self._root_path).as_posix()
+            relative_dir = '' if relative_dir == '.' else f'{relative_dir}/'
+
+            keys = [] if only_files else [f'{relative_dir}{dir_name}/' for dir_name in dir_names]
+            keys += [f'{relative_dir}{file_name}' for file_name in file_names
+                     if not file_name.startswith(self.TMP_PREFIX)]
+
+            for key in sorted(keys):
+                if key.startswith(prefix):
+                    filtered_key = self._filter_key(key, filter_filename, filter_extension)
+                    if filtered_key is not None:
+                        yield filtered_key
+
+    @staticmethod
+    def _filter_key(key, filter_filename, filter_extension):
+        if (filter_filename is not None and filter_filename not in key) or (
+                filter_extension is not None and not key.endswith(filter_extension)):
+            return None
+        else:
+            return key
+
+    def list_objects(self, folder: Union[None, str] = None, filter_filename: Union[None, str] = None,
+                     only_files: bool = True, filter_extension: Union[None, str, tuple] = None) -> Generator:
+        return self._list_local_objects(self._get_folder_path(folder), filter_filename=filter_filename,
+                                        only_files=only_files, filter_extension=filter_extension)
+
+    def _file_move(self, dest_root_path: str, object_name: str, dest_object_name: Union[str, None],
+                   remove_copied: bool):
+        dest_root_path = str(Path(dest_root_path).resolve())
+        if dest_object_name is None and dest_root_path == self.root_path:
+            self._local_logger.warning('This config does not move the object')
+        else:
+            if dest_object_name is None and dest_root_path != self.root_path:
+                dest_object_name = object_name
+
+            source_path = self._local_path(object_name)
+            dest_path = self._local_path(dest_object_name, dest_root_path)
+            dest_path.parent.mkdir(parents=True, exist_ok=True)
+
+            if remove_copied:
+                try:
+                    os.replace(source_path, dest_path)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    # Different filesystems, rename is not possible
+                    with self._atomic_path(dest_path) as tmp_path:
+                        shutil.copyfile(source_path, tmp_path)
+                    os.remove(source_path)
+                self._local_logger.debug(f'{object_name} moved from {self.root_path} to {dest_root_path}')
+            else:
+                with self._atomic_path(dest_path) as tmp_path:
+                    shutil.copyfile(source_path, tmp_path)
+                self._local_logger.debug(f'{object_name} copied from {self.root_path} to {dest_root_path}')
+
+    def move_object(self, dest_storage_name: str, files_to_move: Union[str, list, Generator],
+                    dest_object_name: Union[str, None] = None, remove_copied: bool = False):
+        if isinstance(files_to_move, str):
+            self._file_move(dest_storage_name, files_to_move, dest_object_name, remove_copied)
+        else:
+            for local_object in files_to_move:
+                self._file_move(dest_storage_name, local_object, dest_object_name, remove_copied)
+
+    ###########
+    # READERS #
+    ###########
+    @contextmanager
+    def _read_to_buffer(self, path):
+        self._local_logger.debug(f'Reading from {self.root_path}: {path}')
+
+        with open(self._local_path(path), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._throttle_bytes(size)
+            if size == 0:
+                # Empty files can not be memory mapped
+                yield io.BytesIO()
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    with MemoryViewReader(mapped) as buff:
+                        yield buff
+
+    def read_csv(self, filename: str, folder: Union[str, None] = None, **kwargs):
+        path = self._get_full_path(filename, folder)
+        if self.parser_pool is not None or self.result_cache is not None:
+            return self._read_parsed(path, 'csv', kwargs)
+        self._local_logger.debug(f'Reading from {self.root_path}: {path}')
+        kwargs.setdefault('memory_map', True)
+        return pd.read_csv(self._local_path(path), **kwargs)
+
+    def read_excel(self, filename: str, folder: Union[str, None] = None, **kwargs):
+        return self._read_parsed(self._get_full_path(filename, folder), 'excel', kwargs)
+
+    def read_parquet(self, filename: str, folder: Union[str, None] = None, **kwargs):
+        path = self._get_full_path(filename, folder)
+        self._local_logger.debug(f'Reading from {self.root_path}: {path}')
+        with pa.memory_map(str(self._local_path(path))) as source:
+            return pd.read_parquet(source, **kwargs)
+
+    def read_yaml(self, filename: str, folder: Union[str, None] = None, yaml_loader=yaml.FullLoader):
+        with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
+            return self._parse_buffer('yaml', buff, yaml_loader=yaml_loader)
+
+    def read_json(self, filename: str, folder: Union[str, None] = None, **kwargs):
+        with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
+            return json.load(buff, **kwargs)
+
+    def read_object(self, filename: str, folder: Union[str, None] = None, **kwargs):
+        with self._read_to_buffer(self._get_full_path(filename, folder)) as buff:
+            return buff.read(**kwargs)
+
+    def open(self, filename: str, folder: Union[str, None] = None, mode: str = 'rb', block_size: int = MB,
+             max_read_ahead: Union[int, None] = None, cache_blocks: int = 32, **kwargs):
+        # The file itself, the OS already reads ahead and caches
+        if mode not in ('rb', 'r'):
+            raise ValueError(f'Invalid mode ({mode}), objects can only be opened for reading')
+        return open(self._local_path(self._get_full_path(filename, folder)), mode, **kwargs)
+
+    def read_object_to_file(self, object_filename: str, filename: Union[str, None] = None,
+                            folder: Union[str, None] = None, resumable: bool = False,
+                            checkpoint_dir: Union[str, None] = None, verify: bool = False, **kwargs):
+        # Local copies are not checkpointed nor verified, resumable, checkpoint_dir and verify are accepted for
+        # compatibility, also by write_object_from_file
+        object_filename_full, filename = self._create_local_path(object_filename, filename, folder)
+        self._local_logger.debug(f'Downloading {object_filename_full} to {filename}')
+        with self._atomic_path(filename) as tmp_path:
+            self._copy_file(self._local_path(object_filename_full), tmp_path)
+
+    ###########
+    # WRITERS #
+    ###########
+    def _get_bucket_path(self, filename: str, folder: Union[str, None] = None) -> str:
+        bucket_path = self._get_full_path(filename, folder)
+        self._local_logger.debug(f'Writing in: {bucket_path}')
+
+        return bucket_path
+
+    def _copy_file(self, source_path, dest_path):
+        if self.rate_limiter is None:
+            shutil.copyfile(source_path, dest_path)
+        else:
+            with open(source_path, 'rb') as source, open(dest_path, 'wb') as dest:
+                shutil.copyfileobj(self._throttled(source), dest, self.range_config.part_size)
+
+    @contextmanager
+    def _atomic_path(self, path):
+        # Writes go to a temporary sibling that is renamed over the target, so readers never see partial files
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = str(path.parent / f'{self.TMP_PREFIX}{uuid.uuid4().hex}{path.suffix}')
+        try:
+            yield tmp_path
+            # The caller may have discarded the temporary file to keep the current one
+            if os.path.exists(tmp_path):
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @contextmanager
+    def _write_path(self, filename: str, folder: Union[str, None], if_changed: bool):
+        path = self._local_path(self._get_bucket_path(filename, folder))
+        with self._atomic_path(path) as tmp_path:
+            yield tmp_path
+            self._throttle_bytes(os.path.getsize(tmp_path))
+            if if_changed and path.is_file() and filecmp.cmp(tmp_path, path, shallow=False):
+                os.remove(tmp_path)
+                self._local_logger.debug(f'{path} unchanged, skipping write')
+                self._record_upload('skipped')
+            else:
+                self._record_upload('uploaded')
+
+    def write_csv(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                  if_changed: bool = False, **kwargs):
+        with io.StringIO() as buff:
+            df.to_csv(buff, **kwargs)
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
+
+    def write_excel(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                    if_changed: bool = False, **kwargs):
+        with io.BytesIO() as buff:
+            df.to_excel(buff, **kwargs)
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
+
+    def write_parquet(self, df: pd.DataFrame, filename: str, folder: Union[str, None] = None,
+                      if_changed: bool = False, **kwargs):
+        with io.BytesIO() as buff:
+            df.to_parquet(buff, **kwargs)
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
+
+    def write_yaml(self, data: dict, filename: str, folder: Union[str, None] = None,
+                   if_changed: bool = False, **kwargs):
+        with io.StringIO() as buff:
+            yaml.dump(data, buff, **kwargs)
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
+
+    def write_json(self, data: dict, filename: str, folder: Union[str, None] = None,
+                   if_changed: bool = False, **kwargs):
+        with io.StringIO() as buff:
+            json.dump(data, buff, **kwargs)
+            self._upload_buffer(buff, self._get_bucket_path(filename, folder), if_changed=if_changed)
+
+    def write_object(self, write_object, filename: str, folder: Union[str, None] = None,
+                     if_changed: bool = False, **kwargs):
+        if isinstance(write_object, bytes):
+            self._upload_buffer(io.BytesIO(write_object), self._get_bucket_path(filename, folder),
+                                if_changed=if_changed)
+        elif isinstance(write_object, io.BytesIO):
+            self._upload_buffer(write_object, self._get_bucket_path(filename, folder), if_changed=if_changed)
+        else:
+            self._upload_stream(write_object, self._get_bucket_path(filename, folder), if_changed=if_changed,
+                                **kwargs)
+
+    def write_object_from_file(self, object_filename: str, filename: str, folder: Union[str, None] = None,
+                               if_changed: bool = False, resumable: bool = False,
+                               checkpoint_dir: Union[str, None] = None, verify: bool = False, **kwargs):
+        with self._write_path(filename, folder, if_changed) as tmp_path:
+            shutil.copyfile(object_filename, tmp_path)
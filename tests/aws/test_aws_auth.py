@@ -0,0 +1,26 @@
+import pickle
+
+from caelus.aws.auth import AWSAuth
+
+
+def test_pickled_profile_auth_resolves_credentials_again(tmp_path, monkeypatch):
+    credentials_path = tmp_path / 'credentials'
+    credentials_path.write_text('[caelus]\naws_access_key_id = first-key\naws_secret_access_key = first-secret\n')
+    monkeypatch.setenv('AWS_SHARED_CREDENTIALS_FILE', str(credentials_path))
+    auth = AWSAuth(profile_name='caelus', region_name='us-east-1')
+    assert auth.session.get_credentials().access_key == 'first-key'
+
+    pickled = pickle.dumps(auth)
+    assert b'first-secret' not in pickled
+
+    credentials_path.write_text('[caelus]\naws_access_key_id = second-key\naws_secret_access_key = second-secret\n')
+    unpickled = pickle.loads(pickled)
+    assert unpickled.session.get_credentials().access_key == 'second-key'
+    assert unpickled.session.region_name == 'us-east-1'
+
+
+def test_pickled_static_keys(monkeypatch):
+    monkeypatch.setenv('AWS_SHARED_CREDENTIALS_FILE', '/nonexistent')
+    auth = pickle.loads(pickle.dumps(AWSAuth(key='key', secret_key='secret', region_name='us-east-1')))
+    credentials = auth.session.get_credentials()
+    assert (credentials.access_key, credentials.secret_key) == ('key', 'secret')
@@ -0,0 +1,358 @@
+import io
+import os
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from caelus.aws.auth import AWSAuth
+from caelus.aws.storages import S3Storage
+from caelus.core.checksums import ChecksumError
+from caelus.core.transfers import MB, RangeConfig
+from caelus.local.storages import LocalStorage
+
+
+@pytest.fixture
+def storage():
+    with mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='bucket')
+        yield S3Storage(AWSAuth(region_name='us-east-1'), 'bucket')
+
+
+def interrupt_after(calls: int, fn):
+    # Lets calls go through, then fails like a lost connection
+    done = []
+
+    def wrapper(*args, **kwargs):
+        if len(done) == calls:
+            raise IOError('interrupted')
+        done.append(None)
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def test_resumable_upload_with_other_part_size(storage, tmp_path, monkeypatch):
+    data = os.urandom(23 * MB)
+    local_path = tmp_path / 'data.bin'
+    local_path.write_bytes(data)
+
+    storage.transfer_config = TransferConfig(multipart_threshold=5 * MB, multipart_chunksize=5 * MB, max_concurrency=1)
+    monkeypatch.setattr(storage.s3_client, 'upload_part', interrupt_after(2, storage.s3_client.upload_part))
+    with pytest.raises(IOError):
+        storage.write_object_from_file(str(local_path), 'data.bin', resumable=True)
+    monkeypatch.undo()
+
+    storage.transfer_config = TransferConfig(multipart_threshold=5 * MB, multipart_chunksize=6 * MB, max_concurrency=1)
+    storage.write_object_from_file(str(local_path), 'data.bin', resumable=True)
+    assert storage.read_object('data.bin') == data
+    assert not storage.s3_client.list_multipart_uploads(Bucket='bucket').get('Uploads')
+    assert not list(tmp_path.glob('.*'))
+
+
+def test_resumable_download_with_other_part_size(storage, tmp_path, monkeypatch):
+    data = os.urandom(11 * MB)
+    storage.write_object(data, 'data.bin')
+    local_path = tmp_path / 'data.bin'
+
+    storage.range_config = RangeConfig(part_size=2 * MB, max_workers=1)
+    monkeypatch.setattr(storage, '_read_range', interrupt_after(2, storage._read_range))
+    with pytest.raises(IOError):
+        storage.read_object_to_file('data.bin', str(local_path), resumable=True)
+    monkeypatch.undo()
+
+    storage.range_config = RangeConfig(part_size=3 * MB, max_workers=1)
+    storage.read_object_to_file('data.bin', str(local_path), resumable=True)
+    assert local_path.read_bytes() == data
+    assert not list(tmp_path.glob('.*'))
+
+
+@pytest.mark.parametrize('size', [MB, 11 * MB])
+def test_resumable_upload_extra_args(storage, tmp_path, size):
+    local_path = tmp_path / 'data.bin'
+    local_path.write_bytes(os.urandom(size))
+
+    storage.transfer_config = TransferConfig(multipart_threshold=5 * MB, multipart_chunksize=5 * MB)
+    storage.write_object_from_file(str(local_path), 'data.bin', resumable=True,
+                                   ExtraArgs={'ContentType': 'application/x-test', 'ServerSideEncryption': 'AES256'})
+    response = storage.s3_client.head_object(Bucket='bucket', Key='data.bin')
+    assert response['ContentType'] == 'application/x-test'
+    assert response['ServerSideEncryption'] == 'AES256'
+
+    with pytest.raises(ValueError):
+        storage.write_object_from_file(str(local_path), 'data.bin', resumable=True, Callback=print)
+
+
+def test_resumable_download_of_kms_encrypted_object(storage, tmp_path, monkeypatch):
+    data = os.urandom(5 * MB)
+    storage.write_object(data, 'data.bin')
+    get_object = storage.s3_client.get_object
+    monkeypatch.setattr(storage.s3_client, 'head_object', kms_etag(storage.s3_client.head_object))
+    # The ranges are read with the opaque ETag as IfMatch, moto only knows the md5
+    monkeypatch.setattr(storage.s3_client, 'get_object', lambda IfMatch=None, **kwargs: get_object(**kwargs))
+    local_path = tmp_path / 'data.bin'
+
+    storage.range_config = RangeConfig(part_size=2 * MB, max_workers=1)
+    storage.read_object_to_file('data.bin', str(local_path), resumable=True)
+    assert local_path.read_bytes() == data
+
+
+def test_verified_transfers(storage, tmp_path):
+    data = os.urandom(3 * MB)
+    local_path = tmp_path / 'data.bin'
+    local_path.write_bytes(data)
+
+    storage.write_object_from_file(str(local_path), 'data.bin', verify=True)
+    storage.read_object_to_file('data.bin', str(tmp_path / 'copy.bin'), verify=True)
+    assert (tmp_path / 'copy.bin').read_bytes() == data
+
+
+@pytest.mark.parametrize('size', [MB, 11 * MB])
+def test_verified_resumable_upload(storage, tmp_path, monkeypatch, size):
+    local_path = tmp_path / 'data.bin'
+    local_path.write_bytes(os.urandom(size))
+    storage.transfer_config = TransferConfig(multipart_threshold=5 * MB, multipart_chunksize=5 * MB)
+    storage.write_object_from_file(str(local_path), 'data.bin', resumable=True, verify=True)
+
+    head_object = storage.s3_client.head_object
+
+    def corrupted_etag(**kwargs):
+        response = head_object(**kwargs)
+        response['ETag'] = response['ETag'].replace(response['ETag'][1:9], '00000000')
+        response.pop('ChecksumCRC32C', None)
+        return response
+
+    monkeypatch.setattr(storage.s3_client, 'head_object', corrupted_etag)
+    with pytest.raises(ChecksumError):
+        storage.write_object_from_file(str(local_path), 'data.bin', resumable=True, verify=True)
+
+
+def test_verified_upload_of_kms_encrypted_object(storage, tmp_path, monkeypatch):
+    local_path = tmp_path / 'data.bin'
+    local_path.write_bytes(os.urandom(MB))
+    monkeypatch.setattr(storage.s3_client, 'head_object', kms_etag(storage.s3_client.head_object))
+    storage.write_object_from_file(str(local_path), 'data.bin', verify=True)
+
+
+def test_select_csv(storage):
+    storage.write_object(b'name,city\nana,lisbon\nbob,porto\ncarla,lisbon\n', 'people.csv')
+    df = storage.select('people.csv', "SELECT s.name FROM s3object s WHERE s.city = 'lisbon'")
+    assert df['name'].tolist() == ['ana', 'carla']
+
+
+def test_select_json_records(storage):
+    storage.write_object(b'{"name": "ana", "city": "lisbon"}\n{"name": "bob", "city": "porto"}\n', 'people.json')
+    records = storage.select('people.json', "SELECT * FROM s3object s WHERE s.city = 'porto'", input_format='json',
+                             output='records')
+    assert list(records) == [{'name': 'bob', 'city': 'porto'}]
+
+
+def test_select_unsupported_compression(storage):
+    storage.write_object(b'', 'people.csv.xz')
+    with pytest.raises(ValueError, match='xz'):
+        storage.select('people.csv.xz', 'SELECT * FROM s3object')
+
+
+def kms_etag(fn):
+    # moto returns the md5 as the ETag of SSE-KMS objects, S3 returns an opaque value
+    def wrapper(*args, **kwargs):
+        response = fn(*args, **kwargs)
+        response['ETag'] = '"0123456789abcdef0123456789abcdef"'
+        response['ServerSideEncryption'] = 'aws:kms'
+        return response
+    return wrapper
+
+
+def test_copy_of_kms_encrypted_object(storage, tmp_path, monkeypatch):
+    storage.write_object(b'secret', 'data.bin')
+    monkeypatch.setattr(storage.s3_client, 'head_object', kms_etag(storage.s3_client.head_object))
+    assert storage.stat('data.bin').md5 is None
+
+    local = LocalStorage(str(tmp_path))
+    storage.copy_to(local, 'data.bin', verify=True)
+    assert local.read_object('data.bin') == b'secret'
+
+
+def test_ranged_reads(storage):
+    storage.range_config = RangeConfig(threshold=MB, part_size=MB, max_workers=4)
+    data = os.urandom(3 * MB + 5)
+    storage.write_object(data, 'data.bin')
+    storage.write_object(b'', 'empty.bin')
+
+    assert storage.read_object('data.bin') == data
+    # Ranges of an empty object answer 416, the object is read without one
+    assert storage.read_object('empty.bin') == b''
+
+
+def test_default_transfer_config(storage):
+    storage.transfer_config = TransferConfig(multipart_chunksize=6 * MB)
+    assert storage.range_config.part_size == 6 * MB
+
+    storage.transfer_config = None
+    assert storage.transfer_config.multipart_chunksize == TransferConfig().multipart_chunksize
+    assert storage.range_config.part_size == TransferConfig().multipart_chunksize
+    storage.write_object(b'abc', 'data.bin')
+    assert storage.read_object('data.bin') == b'abc'
+
+
+def test_read_if_modified(storage, monkeypatch):
+    storage.write_json({'version': 1}, 'config.json')
+    first = storage.read_if_modified('config.json', reader='json')
+    assert first.modified and first.value == {'version': 1}
+
+    responses = []
+
+    def get_object(**kwargs):
+        try:
+            response = original(**kwargs)
+        except ClientError as e:
+            responses.append(e.response['Error']['Code'])
+            raise
+        responses.append('200')
+        return response
+    original = storage.s3_client.get_object
+    monkeypatch.setattr(storage.s3_client, 'get_object', get_object)
+
+    unchanged = storage.read_if_modified('config.json', reader='json')
+    assert not unchanged.modified
+    assert unchanged.etag == first.etag and unchanged.value == {'version': 1}
+    assert responses == ['304']
+
+    storage.write_json({'version': 2}, 'config.json')
+    changed = storage.read_if_modified('config.json', reader='json')
+    assert changed.modified and changed.value == {'version': 2} and changed.etag != first.etag
+
+    # Another reader that only kept the etag gets no value
+    other = S3Storage(storage._auth, 'bucket')
+    assert other.read_if_modified('config.json', reader='json', etag=changed.etag).value is None
+    with pytest.raises(FileNotFoundError):
+        storage.read_if_modified('missing.json')
+
+
+@pytest.mark.parametrize('filename', ['records.jsonl', 'records.jsonl.gz', 'records.jsonl.bz2', 'records.jsonl.xz'])
+def test_jsonl_round_trip(storage, filename):
+    records = [{'id': index, 'text': 'x' * (index % 7)} for index in range(5000)]
+    storage.write_jsonl(iter(records), filename)
+    assert list(storage.read_jsonl(filename)) == records
+
+    chunks = list(storage.read_jsonl(filename, chunksize=2000))
+    assert [len(chunk) for chunk in chunks] == [2000, 2000, 1000]
+    assert chunks[2]['id'].tolist() == list(range(4000, 5000))
+
+
+def test_jsonl_compression_argument(storage):
+    storage.write_jsonl([{'a': 1}], 'records.data', compression='gzip')
+    assert storage.read_object('records.data')[:2] == b'\x1f\x8b'
+    assert list(storage.read_jsonl('records.data', compression='gzip')) == [{'a': 1}]
+    storage.write_jsonl([], 'empty.jsonl')
+    assert list(storage.read_jsonl('empty.jsonl')) == []
+
+
+def test_arrow_round_trip(storage):
+    table = pa.table({'id': list(range(1000)), 'name': [f'name-{index}' for index in range(1000)]})
+    storage.write_arrow(table, 'table.parquet')
+    assert storage.read_arrow('table.parquet').equals(table)
+    assert storage.read_arrow('table.parquet', columns=['name']).column_names == ['name']
+
+    # Every batch is a row group, read back one at a time from ranged reads
+    storage.range_config = RangeConfig(threshold=1024, part_size=1024)
+    storage.write_arrow((batch for batch in table.to_batches(max_chunksize=300)), 'batches.parquet')
+    assert pq.ParquetFile(io.BytesIO(storage.read_object('batches.parquet'))).num_row_groups == 4
+    batches = list(storage.iter_record_batches('batches.parquet', columns=['id']))
+    assert [batch.num_rows for batch in batches] == [300, 300, 300, 100]
+    assert pa.Table.from_batches(batches).column('id').to_pylist() == list(range(1000))
+
+
+@pytest.mark.parametrize('ipc_format, compression', [('file', None), ('file', 'zstd'), ('stream', 'lz4')])
+def test_feather_round_trip(storage, tmp_path, monkeypatch, ipc_format, compression):
+    df = pd.DataFrame({'id': range(100), 'value': [index / 2 for index in range(100)]})
+    storage.write_feather(df, 'data.feather', ipc_format=ipc_format, compression=compression)
+
+    pd.testing.assert_frame_equal(storage.read_feather('data.feather'), df)
+    assert storage.read_feather('data.feather', columns=['value'], as_table=True).column_names == ['value']
+    # Kept on local disk and memory mapped, the second read does not download it again
+    downloads = []
+    open_stream = storage._open_stream
+    monkeypatch.setattr(storage, '_open_stream', lambda path: downloads.append(path) or open_stream(path))
+    for _ in range(2):
+        pd.testing.assert_frame_equal(storage.read_feather('data.feather', cache_dir=str(tmp_path)), df)
+    assert downloads == ['data.feather']
+
+
+def test_feather_unknown_format(storage):
+    with pytest.raises(ValueError, match='Unknown IPC format'):
+        storage.write_feather(pd.DataFrame({'a': [1]}), 'data.feather', ipc_format='parquet')
+
+
+def test_stat_and_exists(storage):
+    storage.write_object(b'abcd', 'data.csv', folder='in')
+    stat = storage.stat('data.csv', folder='in')
+    assert (stat.name, stat.size, stat.md5) == ('in/data.csv', 4, 'e2fc714c4727ee9395f324cd2e7f331f')
+    assert storage.exists('data.csv', folder='in')
+    assert not storage.exists('missing.csv', folder='in')
+    with pytest.raises(FileNotFoundError):
+        storage.stat('missing.csv')
+
+
+@pytest.mark.parametrize('count, listed', [(5, False), (150, True)])
+def test_stat_many(storage, monkeypatch, count, listed):
+    for index in range(0, count, 2):
+        storage.write_object(b'x' * index, f'{index:04d}.bin', folder='objects')
+    heads = []
+    head_object = storage.s3_client.head_object
+    monkeypatch.setattr(storage.s3_client, 'head_object',
+                        lambda **kwargs: heads.append(kwargs) or head_object(**kwargs))
+
+    names = [f'{index:04d}.bin' for index in range(count)]
+    stats = storage.stat_many(names, folder='objects')
+    assert list(stats) == names
+    assert [stat.size if stat is not None else None for stat in stats.values()] == [
+        index if index % 2 == 0 else None for index in range(count)]
+    # Dense keys are found with a listing of their common prefix instead of a HEAD each
+    assert (heads == []) == listed
+    assert storage.exists_many(names[:2], folder='objects') == {names[0]: True, names[1]: False}
+
+
+def test_profile(storage, tmp_path):
+    storage.write_csv(pd.DataFrame({'value': [1, 2]}), 'data.csv', index=False)
+    trace_path = tmp_path / 'trace.json'
+    with storage.profile(str(trace_path)) as profiler:
+        storage.read_csv('data.csv')
+    storage.read_csv('data.csv')
+
+    spans = [event for event in profiler.events if event['ph'] == 'X']
+    assert [span['cat'] for span in spans][-1] == 'serialization'
+    assert [span['args']['path'] for span in spans if span['name'] == 'GetObject'] == ['data.csv']
+    assert trace_path.exists()
+
+
+def test_open(storage):
+    data = os.urandom(3 * MB + 5)
+    storage.write_object(data, 'data.bin')
+    with storage.open('data.bin', block_size=MB // 4) as f:
+        assert f.read(10) == data[:10]
+        f.seek(-5, io.SEEK_END)
+        assert f.read() == data[-5:]
+        f.seek(MB)
+        assert f.read(MB) == data[MB:2 * MB]
+        assert f.tell() == 2 * MB
+
+    storage.write_object(b'a,b\n1,2\n', 'data.csv')
+    with storage.open('data.csv', mode='r') as f:
+        assert f.readlines() == ['a,b\n', '1,2\n']
+    with pytest.raises(ValueError):
+        storage.open('data.csv', mode='wb')
+
+
+def test_open_rewritten_object(storage):
+    storage.write_object(os.urandom(2 * MB), 'data.bin')
+    with storage.open('data.bin', block_size=MB, max_read_ahead=MB) as f:
+        f.read(10)
+        storage.write_object(os.urandom(2 * MB), 'data.bin')
+        f.seek(MB + 10)
+        with pytest.raises(ClientError):
+            f.read(10)
@@ -0,0 +1,88 @@
+import io
+import os
+import random
+
+import pytest
+
+from caelus.core.buffers import CachedRangedFile, RangedFile
+
+
+class FakeObject(object):
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.ranges = []
+
+    def read_range(self, start: int, end: int) -> bytes:
+        self.ranges.append((start, end))
+        return self.data[start:end]
+
+
+@pytest.mark.parametrize('file_class', [RangedFile, CachedRangedFile])
+def test_seek_and_read_match_bytes_io(file_class):
+    data = os.urandom(10000 + 7)
+    obj = FakeObject(data)
+    args = (1024, 4096, 4) if file_class is CachedRangedFile else ()
+    ranged = io.BufferedReader(file_class(obj.read_range, len(data), *args), buffer_size=1024)
+    expected = io.BytesIO(data)
+
+    rng = random.Random(0)
+    for _ in range(300):
+        operation = rng.choice(['seek', 'seek_cur', 'seek_end', 'read', 'read', 'read'])
+        if operation == 'seek':
+            offset = rng.randrange(len(data) + 100)
+            assert ranged.seek(offset) == expected.seek(offset)
+        elif operation == 'seek_cur':
+            offset = rng.randrange(-min(expected.tell(), 500), 500)
+            assert ranged.seek(offset, io.SEEK_CUR) == expected.seek(offset, io.SEEK_CUR)
+        elif operation == 'seek_end':
+            offset = -rng.randrange(len(data))
+            assert ranged.seek(offset, io.SEEK_END) == expected.seek(offset, io.SEEK_END)
+        else:
+            size = rng.choice([-1, 0, 1, 100, 1024, 3000])
+            assert ranged.read(size) == expected.read(size)
+        assert ranged.tell() == expected.tell()
+
+
+def test_sequential_reads_grow_read_ahead():
+    obj = FakeObject(os.urandom(64 * 100))
+    ranged = CachedRangedFile(obj.read_range, len(obj.data), 100, 800)
+
+    for _ in range(8):
+        ranged.read(100)
+    assert obj.ranges == [(0, 100), (100, 400), (400, 700), (700, 1200)]
+    ranged.read(100)
+    assert obj.ranges[-1] == (1200, 1700)
+
+    ranged.seek(5000)
+    ranged.read(100)
+    assert obj.ranges[-1] == (5000, 5100)
+
+
+def test_missing_blocks_in_one_request():
+    obj = FakeObject(os.urandom(1000))
+    ranged = CachedRangedFile(obj.read_range, len(obj.data), 100, 100)
+
+    ranged.seek(300)
+    ranged.read(100)
+    ranged.seek(100)
+    assert ranged.read(500) == obj.data[100:600]
+    # Block 3 is cached, the others are fetched by two requests around it
+    assert obj.ranges == [(300, 400), (100, 300), (400, 600)]
+    assert ranged.requests == 3
+
+
+def test_cache_eviction():
+    obj = FakeObject(os.urandom(1000))
+    ranged = CachedRangedFile(obj.read_range, len(obj.data), 100, 100, cache_blocks=2)
+
+    for block in (0, 5, 9, 0):
+        ranged.seek(block * 100)
+        ranged.read(1)
+    assert obj.ranges == [(0, 100), (500, 600), (900, 1000), (0, 100)]
+
+
+def test_short_range():
+    ranged = CachedRangedFile(lambda start, end: b'x', 1000, 100, 100)
+    with pytest.raises(IOError):
+        ranged.read(100)
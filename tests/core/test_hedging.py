@@ -0,0 +1,24 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from caelus.core.hedging import HedgePolicy
+
+policy = HedgePolicy(min_samples=1)
+
+
+def call_in_child():
+    return policy.call(os.getpid)
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+def test_forked_child_gets_its_own_executor():
+    assert policy.call(os.getpid) == os.getpid()
+    # Held while the child is forked, like a lock taken by another thread of the parent
+    with policy._lock:
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('fork')) as executor:
+            child_pid = executor.submit(call_in_child).result(timeout=30)
+    assert child_pid != os.getpid()
+    policy.shutdown()
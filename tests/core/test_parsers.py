@@ -0,0 +1,47 @@
+import io
+import os
+
+import pandas as pd
+import pytest
+
+from caelus.core.parsers import ParserPool, parse
+
+
+def mixed(value):
+    return int(value) if value.isdigit() else [value]
+
+
+def shared_memory_blocks() -> set:
+    return {name for name in os.listdir('/dev/shm') if name.startswith('psm_')}
+
+
+@pytest.fixture(scope='module')
+def pool():
+    with ParserPool(processes=2) as pool:
+        yield pool
+
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm'), reason='needs /dev/shm')
+def test_parse_in_workers_frees_shared_memory(pool):
+    before = shared_memory_blocks()
+    df = pool.parse('csv', memoryview(b'a,b\n1,x\n2,y\n'))
+    pd.testing.assert_frame_equal(df, pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']}))
+    assert pool.parse('yaml', b'a: [1, 2]\n') == {'a': [1, 2]}
+
+    with pytest.raises(ValueError, match='Unknown reader'):
+        pool.parse('xml', b'<a/>')
+    with pytest.raises(pd.errors.ParserError):
+        pool.parse('csv', b'a,b\n1,2,3,4\n"')
+    assert shared_memory_blocks() == before
+
+
+def test_parse_values_arrow_can_not_convert(pool):
+    # Values that are not DataFrames, and DataFrames with object columns Arrow rejects, come back pickled
+    assert pool.parse('json', b'{"a": 1}') == {'a': 1}
+    df = pool.parse('csv', b'a\n1\nx\n', converters={'a': mixed})
+    assert df['a'].tolist() == [1, ['x']]
+
+
+def test_parse_empty_payload(pool):
+    assert pool.parse('bytes', b'') == b''
+    assert parse('bytes', io.BytesIO(b'abc')) == b'abc'
@@ -0,0 +1,64 @@
+import json
+import threading
+
+import pytest
+
+from caelus.core.profiling import NETWORK, QUEUE, SERIALIZATION, ProfiledExecutor, Profiler
+
+
+def test_spans_and_summary():
+    profiler = Profiler()
+    start = profiler._origin
+    profiler.add('GET', NETWORK, start + 1, start + 3, path='data.bin')
+    profiler.add('PUT', NETWORK, start + 2, start + 2.5)
+    with profiler.span('parse csv', SERIALIZATION):
+        pass
+
+    spans = [event for event in profiler.events if event['ph'] == 'X']
+    assert [span['name'] for span in spans] == ['GET', 'PUT', 'parse csv']
+    assert spans[0]['ts'] == pytest.approx(1e6) and spans[0]['dur'] == pytest.approx(2e6)
+    assert spans[0]['args'] == {'path': 'data.bin'}
+    assert profiler.summary()[NETWORK] == pytest.approx(2.5)
+    assert SERIALIZATION in profiler.summary()
+
+
+def test_span_recorded_on_error():
+    profiler = Profiler()
+    with pytest.raises(ValueError):
+        with profiler.span('parse json', SERIALIZATION):
+            raise ValueError
+    assert [event['name'] for event in profiler.events if event['ph'] == 'X'] == ['parse json']
+
+
+def test_async_spans_not_summed():
+    profiler = Profiler()
+    start = profiler._origin
+    profiler.add_async('read queued', QUEUE, start, start + 1)
+    profiler.add_async('read queued', QUEUE, start, start + 2)
+
+    events = [event for event in profiler.events if event['ph'] in 'be']
+    assert [event['ph'] for event in events] == ['b', 'e', 'b', 'e']
+    assert events[0]['id'] == events[1]['id'] != events[2]['id']
+    assert profiler.summary() == {}
+
+
+def test_thread_names(tmp_path):
+    profiler = Profiler()
+    thread = threading.Thread(target=lambda: profiler.add('GET', NETWORK, 0, 1), name='worker')
+    thread.start()
+    thread.join()
+
+    path = tmp_path / 'trace.json'
+    profiler.save(str(path))
+    trace = json.loads(path.read_text())
+    names = {event['tid']: event['args']['name'] for event in trace['traceEvents'] if event['ph'] == 'M'}
+    assert names == {thread.ident: 'worker'}
+
+
+def test_profiled_executor():
+    profiler = Profiler()
+    with ProfiledExecutor(profiler, 'read', max_workers=1) as executor:
+        assert [future.result() for future in [executor.submit(pow, 2, n) for n in range(3)]] == [1, 2, 4]
+    queued = [event for event in profiler.events if event['ph'] == 'b']
+    assert len(queued) == 3
+    assert {event['name'] for event in queued} == {'read queued'}
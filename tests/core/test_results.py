@@ -0,0 +1,87 @@
+import os
+import pickle
+import time
+from datetime import timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from caelus.core.results import ResultCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / 'cache'))
+
+
+def entry_size(cache, key: str) -> int:
+    return os.path.getsize(cache._path(key))
+
+
+def test_hit_and_miss(cache):
+    key = cache.key('s3://bucket/data.csv', 'etag', 'csv', {'sep': ';'})
+    assert cache.get(key) is None
+
+    df = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+    assert cache.put(key, df)
+    pd.testing.assert_frame_equal(cache.get(key), df)
+    assert cache.get(cache.key('s3://bucket/data.csv', 'other', 'csv', {'sep': ';'})) is None
+    assert cache.get(cache.key('s3://bucket/data.csv', 'etag', 'csv', {'sep': ','})) is None
+
+
+def test_key_of_non_json_arguments(cache):
+    assert cache.key('uri', 'etag', 'csv', {'dtype': str}) == cache.key('uri', 'etag', 'csv', {'dtype': str})
+    assert cache.key('uri', 'etag', 'csv', {'dtype': str}) != cache.key('uri', 'etag', 'csv', {'dtype': int})
+
+
+def test_values_arrow_can_not_store(cache):
+    assert not cache.put('key', {'a': 1})
+    assert not cache.put('key', pd.DataFrame({'a': [1, [1, 2]]}))
+    assert cache.get('key') is None
+
+
+def test_expiry(cache):
+    cache.max_age = timedelta(hours=1)
+    cache.put('key', pd.DataFrame({'a': [1]}))
+    assert cache.get('key') is not None
+
+    written = time.time() - 2 * 3600
+    os.utime(cache._path('key'), (written, written))
+    assert cache.get('key') is None
+    assert not cache._path('key').exists()
+
+
+def test_eviction_of_least_recently_read(cache):
+    df = pd.DataFrame({'a': range(100)})
+    cache.put('first', df)
+    cache.put('second', df)
+    now = time.time()
+    os.utime(cache._path('first'), (now - 20, now - 20))
+    os.utime(cache._path('second'), (now - 10, now - 10))
+    # Reading first makes second the least recently read
+    assert cache.get('first') is not None
+
+    cache.max_size = 2 * entry_size(cache, 'first')
+    cache.put('third', df)
+    assert cache.get('second') is None
+    assert cache.get('first') is not None and cache.get('third') is not None
+
+
+def test_entry_removed_after_stat(cache, monkeypatch):
+    cache.put('key', pd.DataFrame({'a': [1]}))
+    original = pa.memory_map
+
+    def memory_map(path, *args, **kwargs):
+        os.remove(path)
+        return original(path, *args, **kwargs)
+
+    monkeypatch.setattr(pa, 'memory_map', memory_map)
+    assert cache.get('key') is None
+
+
+def test_pickle(cache):
+    cache.max_age = timedelta(days=1)
+    restored = pickle.loads(pickle.dumps(cache))
+    assert (restored.cache_dir, restored.max_size, restored.max_age) == (cache.cache_dir, cache.max_size,
+                                                                         cache.max_age)
@@ -0,0 +1,88 @@
+import io
+import pickle
+
+import pytest
+
+from caelus.core import throttle
+from caelus.core.throttle import RateLimiter, ThrottledFile, TokenBucket
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(throttle, 'time', clock)
+    return clock
+
+
+def test_bucket_burst_then_rate(clock):
+    bucket = TokenBucket(rate=100, capacity=50)
+    bucket.consume(50)
+    assert clock.sleeps == []
+    bucket.consume(25)
+    assert clock.sleeps == [pytest.approx(0.25)]
+
+    # Refilled while idle, never above the capacity
+    clock.now += 10
+    bucket.consume(50)
+    assert len(clock.sleeps) == 1
+
+
+def test_bucket_paces_amounts_bigger_than_capacity(clock):
+    bucket = TokenBucket(rate=10, capacity=5)
+    bucket.consume(25)
+    assert clock.sleeps == [pytest.approx(2.0)]
+    bucket.consume(1)
+    assert clock.sleeps[-1] == pytest.approx(0.1)
+
+
+def test_rate_limiter(clock):
+    limiter = RateLimiter(bytes_per_second=1000, requests_per_second=2, burst_seconds=0.5)
+    limiter.throttle_bytes(500)
+    limiter.throttle_request()
+    assert clock.sleeps == []
+    limiter.throttle_request()
+    limiter.throttle_bytes(1000)
+    assert clock.sleeps == [pytest.approx(0.5), pytest.approx(0.5)]
+
+    unlimited = RateLimiter()
+    unlimited.throttle_bytes(10 ** 9)
+    unlimited.throttle_request()
+    assert len(clock.sleeps) == 2
+
+
+def test_rate_limiter_pickles_with_full_buckets(clock):
+    limiter = RateLimiter(bytes_per_second=100)
+    limiter.throttle_bytes(100)
+    copy = pickle.loads(pickle.dumps(limiter))
+    assert copy.bytes_per_second == 100
+    copy.throttle_bytes(100)
+    assert clock.sleeps == []
+
+
+def test_throttled_file(clock):
+    limiter = RateLimiter(bytes_per_second=10, burst_seconds=1)
+    reader = ThrottledFile(io.BytesIO(b'x' * 30), limiter)
+    assert reader.read(10) == b'x' * 10
+    buffer = bytearray(20)
+    assert reader.readinto(buffer) == 20
+    assert clock.sleeps == [pytest.approx(2.0)]
+    assert reader.tell() == 30
+
+    writer = ThrottledFile(io.BytesIO(), limiter)
+    writer.write(b'abcde')
+    assert clock.sleeps[-1] == pytest.approx(0.5)
+    assert writer.getvalue() == b'abcde'
@@ -0,0 +1,45 @@
+import pytest
+
+from caelus.core.storages import ObjectStat
+from caelus.core.transfers import RangeConfig, ranged_download
+
+
+def object_reader(data: bytes, calls: list):
+    stat = ObjectStat(name='data.bin', size=len(data), etag='etag', md5=None, last_modified=None, content_type=None)
+
+    def read_first_range(end):
+        calls.append((0, min(end, len(data))))
+        return data[:end], stat
+
+    def read_range(start, end, etag):
+        assert etag == 'etag'
+        calls.append((start, end))
+        return data[start:end]
+    return read_first_range, read_range
+
+
+def test_object_within_threshold_is_one_request():
+    calls = []
+    assert ranged_download(*object_reader(b'abc', calls), RangeConfig(threshold=3, part_size=2)) == b'abc'
+    assert calls == [(0, 3)]
+
+
+def test_empty_object():
+    calls = []
+    assert ranged_download(*object_reader(b'', calls), RangeConfig(threshold=4, part_size=2)) == b''
+    assert calls == [(0, 0)]
+
+
+def test_last_range_smaller_than_part_size():
+    calls = []
+    data = bytes(range(10))
+    assert ranged_download(*object_reader(data, calls), RangeConfig(threshold=3, part_size=4)) == data
+    assert sorted(calls) == [(0, 3), (3, 7), (7, 10)]
+
+
+def test_short_range_raises():
+    data = bytes(range(10))
+    read_first_range, _ = object_reader(data, [])
+    with pytest.raises(IOError, match='expected 4 bytes'):
+        ranged_download(read_first_range, lambda start, end, etag: data[start:end - 1],
+                        RangeConfig(threshold=3, part_size=4))
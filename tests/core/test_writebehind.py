@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from caelus.core.writebehind import WriteBehindError, WriteBehindQueue
+
+
+def test_same_key_in_submission_order():
+    queue = WriteBehindQueue(max_workers=4, max_pending=16)
+    done = []
+
+    def write(key, value, delay):
+        def fn():
+            time.sleep(delay)
+            done.append((key, value))
+        return fn
+
+    for value, delay in enumerate([0.05, 0.02, 0.0]):
+        queue.submit('a', write('a', value, delay))
+    queue.submit('b', write('b', 0, 0.0))
+    queue.close()
+
+    assert [value for key, value in done if key == 'a'] == [0, 1, 2]
+    # Other keys are not held back
+    assert done.index(('b', 0)) < done.index(('a', 0))
+
+
+def test_submit_blocks_while_max_pending():
+    queue = WriteBehindQueue(max_workers=1, max_pending=2)
+    release = threading.Event()
+    queue.submit('a', release.wait)
+    queue.submit('b', lambda: None)
+
+    submitted = threading.Event()
+    thread = threading.Thread(target=lambda: (queue.submit('c', lambda: None), submitted.set()))
+    thread.start()
+    assert not submitted.wait(0.1)
+    release.set()
+    assert submitted.wait(5)
+    thread.join()
+    queue.close()
+
+
+def test_errors_raised_on_flush_and_close():
+    queue = WriteBehindQueue()
+
+    def fail():
+        raise IOError('disconnected')
+
+    queue.submit('a', fail)
+    queue.submit('b', lambda: None)
+    with pytest.raises(WriteBehindError) as error:
+        queue.flush()
+    assert [key for key, _ in error.value.errors] == ['a']
+    assert isinstance(error.value.errors[0][1], IOError)
+    # Reported once
+    queue.flush()
+
+    queue.submit('c', fail)
+    with pytest.raises(WriteBehindError):
+        queue.close()
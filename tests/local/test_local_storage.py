@@ -0,0 +1,197 @@
+import multiprocessing
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+from caelus.core.writebehind import WriteBehindError
+from caelus.local.storages import LocalStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorage(str(tmp_path / 'root'))
+
+
+def test_read_write_round_trip(storage):
+    df = pd.DataFrame({'name': ['ana', 'bob'], 'age': [30, 25]})
+    storage.write_csv(df, 'people.csv', folder='data', index=False)
+    storage.write_parquet(df, 'people.parquet', folder='data')
+    storage.write_json({'a': [1, 2]}, 'config.json')
+    storage.write_yaml({'b': {'c': 3}}, 'config.yaml')
+    storage.write_object(b'payload', 'raw.bin')
+
+    pd.testing.assert_frame_equal(storage.read_csv('people.csv', folder='data'), df)
+    pd.testing.assert_frame_equal(storage.read_parquet('people.parquet', folder='data'), df)
+    assert storage.read_json('config.json') == {'a': [1, 2]}
+    assert storage.read_yaml('config.yaml') == {'b': {'c': 3}}
+    assert storage.read_object('raw.bin') == b'payload'
+    assert (storage._root_path / 'data' / 'people.csv').is_file()
+
+
+
+def test_if_changed(storage):
+    storage.write_json({'a': 1}, 'config.json', if_changed=True)
+    storage.write_json({'a': 1}, 'config.json', if_changed=True)
+    storage.write_json({'a': 2}, 'config.json', if_changed=True)
+    assert storage.read_json('config.json') == {'a': 2}
+    assert storage.upload_stats == {'uploaded': 2, 'skipped': 1}
+
+
+def test_write_behind(storage, monkeypatch):
+    threads = set()
+    upload_fileobj = storage._upload_fileobj
+
+    def record_thread(fileobj, path, **kwargs):
+        threads.add(threading.current_thread().name)
+        upload_fileobj(fileobj, path, **kwargs)
+
+    monkeypatch.setattr(storage, '_upload_fileobj', record_thread)
+    with storage.write_behind(max_workers=2, max_pending=2):
+        for index in range(5):
+            storage.write_json({'index': index}, 'config.json')
+            storage.write_object(bytes([index]), f'{index}.bin')
+    assert storage.read_json('config.json') == {'index': 4}
+    assert [storage.read_object(f'{index}.bin') for index in range(5)] == [bytes([index]) for index in range(5)]
+    assert all(name.startswith('write-behind') for name in threads)
+
+    def fail(fileobj, path, **kwargs):
+        raise IOError('disk full')
+
+    monkeypatch.setattr(storage, '_upload_fileobj', fail)
+    with pytest.raises(WriteBehindError):
+        with storage.write_behind():
+            storage.write_object(b'lost', 'lost.bin')
+
+def test_base_path_and_files(storage, tmp_path):
+    storage.base_path = 'base'
+    local_path = tmp_path / 'local.bin'
+    local_path.write_bytes(b'')
+    storage.write_object_from_file(str(local_path), 'empty.bin', folder='in')
+    assert (storage._root_path / 'base' / 'in' / 'empty.bin').is_file()
+    assert storage.read_object('empty.bin', folder='in') == b''
+
+    storage.write_object(b'abc', 'data.bin', folder='in')
+    storage.read_object_to_file('data.bin', str(tmp_path / 'out.bin'), folder='in')
+    assert (tmp_path / 'out.bin').read_bytes() == b'abc'
+
+
+def test_list_objects(storage):
+    for name in ('data/part-0.csv', 'data/part-1.csv', 'data/sub/part-2.csv', 'data/other.txt', 'database.csv'):
+        storage.write_object(b'x', name)
+    (storage._root_path / 'data' / f'{LocalStorage.TMP_PREFIX}partial.csv').write_bytes(b'x')
+
+    assert list(storage.list_objects('data/')) == ['data/other.txt', 'data/part-0.csv', 'data/part-1.csv',
+                                                   'data/sub/part-2.csv']
+    assert list(storage.list_objects('data/part')) == ['data/part-0.csv', 'data/part-1.csv']
+    assert sorted(storage.list_objects('data', filter_extension='.csv')) == [
+        'data/part-0.csv', 'data/part-1.csv', 'data/sub/part-2.csv', 'database.csv']
+    assert 'data/sub/' in list(storage.list_objects('data/', only_files=False))
+    assert list(storage.list_objects('missing/')) == []
+
+
+def test_stat_and_exists(storage):
+    storage.write_object(b'abcd', 'data.csv')
+    stat = storage.stat('data.csv')
+    assert (stat.name, stat.size, stat.content_type) == ('data.csv', 4, 'text/csv')
+
+    storage.write_object(b'abcdef', 'data.csv')
+    assert storage.stat('data.csv').etag != stat.etag
+    assert storage.exists('data.csv')
+    assert not storage.exists('missing.csv')
+    with pytest.raises(FileNotFoundError):
+        storage.stat('missing.csv')
+
+
+def test_copy_and_move(storage, tmp_path):
+    storage.write_object(b'a', 'a.bin')
+    storage.write_object(b'b', 'b.bin')
+    other_root = str(tmp_path / 'other')
+
+    storage.move_object(other_root, 'a.bin')
+    assert storage.exists('a.bin')
+    assert LocalStorage(other_root).read_object('a.bin') == b'a'
+
+    storage.move_object(storage.root_path, 'b.bin', dest_object_name='moved/b.bin', remove_copied=True)
+    assert not storage.exists('b.bin')
+    assert storage.read_object('moved/b.bin') == b'b'
+
+    storage.move_object(storage.root_path, 'a.bin')
+    assert storage.read_object('a.bin') == b'a'
+
+
+def write_copy(storage, object_name):
+    storage.write_object(storage.read_object(object_name), f'{object_name}.copy')
+    return os.getpid(), storage.upload_stats['uploaded']
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='workers are forked')
+def test_map_does_not_inherit_held_locks(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    for index in range(4):
+        storage.write_object(b'x' * index, f'{index}.bin')
+
+    # Held while the workers are forked, like a lock taken by another thread of the parent
+    with storage._upload_stats_lock:
+        results = storage.map(write_copy, [f'{index}.bin' for index in range(4)], processes=2)
+
+    assert all(pid != os.getpid() for pid, _ in results)
+    assert [storage.read_object(f'{index}.bin.copy') for index in range(4)] == [b'x' * index for index in range(4)]
+
+
+def test_read_if_modified(storage):
+    storage.write_object(b'a,b\n1,2\n', 'data.csv')
+    first = storage.read_if_modified('data.csv', reader='csv')
+    assert first.modified and first.value.to_dict('records') == [{'a': 1, 'b': 2}]
+
+    unchanged = storage.read_if_modified('data.csv', reader='csv')
+    assert not unchanged.modified and unchanged.value is first.value
+
+    storage.write_object(b'a,b\n3,4\n', 'data.csv')
+    assert storage.read_if_modified('data.csv', reader='csv').value.to_dict('records') == [{'a': 3, 'b': 4}]
+
+
+def test_iter_read_resolves_names(storage):
+    storage.base_path = 'base'
+    for index in range(5):
+        storage.write_json({'index': index}, f'{index}.json', folder='shards')
+
+    names = [f'{index}.json' for index in range(5)]
+    assert list(storage.iter_read(names, folder='shards', reader='json', prefetch=2)) == [
+        (name, {'index': index}) for index, name in enumerate(names)]
+    assert [value for _, value in storage.iter_read('shards', reader='json')] == [{'index': index}
+                                                                                  for index in range(5)]
+    assert [name for name, _ in storage.iter_read('shards', reader='json')][0] == 'base/shards/0.json'
+
+
+def test_iter_read_stops_early(storage):
+    for index in range(10):
+        storage.write_json({'index': index}, f'{index:02d}.json')
+    reads = storage.iter_read([f'{index:02d}.json' for index in range(10)], reader='json', prefetch=1)
+    assert next(reads) == ('00.json', {'index': 0})
+    reads.close()
+
+
+def test_read_many_resolves_names(storage):
+    storage.base_path = 'base'
+    for index in range(3):
+        storage.write_csv(pd.DataFrame({'value': [index, index]}), f'{index}.csv', folder='shards', index=False)
+        storage.write_parquet(pd.DataFrame({'value': [index]}), f'{index}.parquet', folder='tables')
+
+    df = storage.read_csv_many([f'{index}.csv' for index in range(3)], folder='shards', processes=1,
+                               source_column='source')
+    assert df['value'].tolist() == [0, 0, 1, 1, 2, 2]
+    assert df['source'].astype(str).tolist()[::2] == ['0.csv', '1.csv', '2.csv']
+    assert storage.read_parquet_many('tables/', max_workers=2)['value'].tolist() == [0, 1, 2]
+
+
+def test_read_csv_many_in_parser_pool(storage, caplog):
+    storage.write_csv(pd.DataFrame({'value': [1]}), 'data.csv', index=False)
+    storage.parser_pool = 1
+    try:
+        with caplog.at_level('WARNING', logger='core'):
+            assert storage.read_csv_many(['data.csv'], processes=4)['value'].tolist() == [1]
+        assert 'processes=4 ignored' in caplog.text
+    finally:
+        storage.parser_pool.shutdown()